@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+"""
+Measure the throughput of destream on deterministic corpora
+
+Each case runs in its own process: the time to open the archive and read
+its first byte (ttfb), the time to read everything (MB/s of uncompressed
+data) and the peak RSS of the process are recorded. The results are
+written as JSON and two result files can be compared with --compare.
+
+    python benchmarks/bench.py -o results.json
+    python benchmarks/bench.py --compare before.json results.json
+"""
+
+import argparse
+import bz2
+import gzip
+import io
+import json
+import lzma
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, "scripts", "destream")
+CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+SEED = 20240101
+WORDS = (
+    b"stream archive member header block frame index window offset "
+    b"checksum payload record buffer chunk table level dictionary"
+).split()
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def random_bytes(rng, size):
+    return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+
+def compressible_bytes(rng, size):
+    data = bytearray()
+    while len(data) < size:
+        data += b" ".join(rng.choice(WORDS) for _ in range(64)) + b"\n"
+    return bytes(data[:size])
+
+
+def make_shapes(scale):
+    """
+    Return the corpora: name -> list of (filename, content), a single
+    member for the shapes that are not packs
+    """
+    rng = random.Random(SEED)
+    large = int(64 * MB * scale)
+    return {
+        "tiny": [("tiny", compressible_bytes(rng, 100))],
+        "compressible": [("compressible", compressible_bytes(rng, large))],
+        "incompressible": [("incompressible", random_bytes(rng, large // 4))],
+        "many-members": [
+            (f"dir{i % 10}/member{i}", compressible_bytes(rng, 2000))
+            for i in range(int(2000 * scale) or 1)
+        ],
+    }
+
+
+def _tar(members):
+    raw = io.BytesIO()
+    with tarfile.open(fileobj=raw, mode="w") as tar:
+        for filename, content in members:
+            tarinfo = tarfile.TarInfo(filename)
+            tarinfo.size = len(content)
+            tarinfo.mtime = 0
+            tar.addfile(tarinfo, io.BytesIO(content))
+    return raw.getvalue()
+
+
+def _zip(members):
+    raw = io.BytesIO()
+    with zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for filename, content in members:
+            info = zipfile.ZipInfo(filename, (1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zipf.writestr(info, content)
+    return raw.getvalue()
+
+
+COMPRESSIONS = {
+    "gz": lambda data: gzip.compress(data, mtime=0),
+    "bz2": bz2.compress,
+    "xz": lzma.compress,
+    "lzma": lambda data: lzma.compress(data, lzma.FORMAT_ALONE),
+}
+if zstandard is not None:
+    COMPRESSIONS["zst"] = zstandard.ZstdCompressor().compress
+
+# NOTE: (case name, extensions applied from the left), packs are made of
+#       all the members of a shape, the compressions of a single member
+FORMATS = [(name, [name]) for name in COMPRESSIONS] + [
+    ("tar", ["tar"]),
+    ("zip", ["zip"]),
+    ("tar.gz", ["tar", "gz"]),
+    ("tar.gz.xz", ["tar", "gz", "xz"]),
+    ("gz.bz2", ["gz", "bz2"]),
+]
+
+
+def build_corpus(directory, scale):
+    """
+    Write the corpus files and return the list of (format, shape, path,
+    uncompressed size)
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for shape, members in make_shapes(scale).items():
+        for name, extensions in FORMATS:
+            is_pack = extensions[0] in ("tar", "zip")
+            if len(members) > 1 and not is_pack:
+                continue
+            if is_pack:
+                data = (_tar if extensions[0] == "tar" else _zip)(members)
+                compressions = extensions[1:]
+            else:
+                data = members[0][1]
+                compressions = extensions
+            size = sum(len(x) for _, x in members)
+            for extension in compressions:
+                data = COMPRESSIONS[extension](data)
+            path = os.path.join(directory, f"{shape}.{name}")
+            with open(path, "wb") as fh:
+                fh.write(data)
+            corpus.append((name, shape, path, size))
+    return corpus
+
+
+def run_case(spec):
+    """
+    Run a single case in this process and return its measures
+    """
+    sys.path.insert(0, ROOT)
+    import destream
+
+    options = spec["options"]
+    if spec["kind"] == "guess":
+        guesser = destream.Guesser(**options)
+        with open(spec["path"], "rb") as fh:
+            data = fh.read()
+        seconds = 0.0
+        for _ in range(spec["repeat"]):
+            archive = destream.ArchiveFile(io.BytesIO(data), spec["path"])
+            start = time.perf_counter()
+            guesser.guess(archive)
+            seconds += time.perf_counter() - start
+        return {"seconds": seconds / spec["repeat"]}
+    if spec["kind"] == "cli":
+        command = [sys.executable, SCRIPT] + spec["args"] + [spec["path"]]
+        output = tempfile.mkdtemp() if "-o" in spec["args"] else None
+        if output:
+            command[command.index("-o") + 1] = output
+        start = time.perf_counter()
+        env = dict(os.environ, PYTHONPATH=ROOT)
+        with open(os.devnull, "wb") as devnull:
+            subprocess.run(command, stdout=devnull, env=env, check=True)
+        seconds = time.perf_counter() - start
+        if output:
+            shutil.rmtree(output)
+        return {"seconds": seconds}
+    buffer = bytearray(CHUNK_SIZE)
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    with destream.open(spec["path"], **options) as archive:
+        if isinstance(archive, destream.ArchivePack):
+            streams = (x for _, x in archive.iter_members())
+        else:
+            streams = [archive]
+        for stream in streams:
+            read = getattr(stream, "readinto", None)
+            while True:
+                if read is not None:
+                    count = read(buffer)
+                else:
+                    count = len(stream.read(CHUNK_SIZE))
+                if not count:
+                    break
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                size += count
+        decompressors = [x.__name__ for x in archive._decompressors]
+    seconds = time.perf_counter() - start
+    return {
+        "seconds": seconds,
+        "ttfb": ttfb,
+        "bytes": size,
+        "decompressors": decompressors,
+    }
+
+
+def measure(spec):
+    """
+    Run a case in a child process, return its measures with the peak RSS
+    of the child (in KiB)
+    """
+    p = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--case",
+            json.dumps(spec),
+        ],
+        stdout=subprocess.PIPE,
+    )
+    output = p.stdout.read()
+    p.stdout.close()
+    _, status, rusage = os.wait4(p.pid, 0)
+    if os.WIFEXITED(status):
+        p.returncode = os.WEXITSTATUS(status)
+    else:
+        p.returncode = -os.WTERMSIG(status)
+    if p.returncode:
+        return {"error": p.returncode}
+    result = json.loads(output)
+    result["peak_rss_kib"] = rusage.ru_maxrss
+    result["cpu_seconds"] = rusage.ru_utime + rusage.ru_stime
+    return result
+
+
+def iter_specs(corpus, engines, repeat):
+    for name, shape, path, size in corpus:
+        for engine in engines:
+            yield {
+                "kind": "open",
+                "name": f"open:{name}:{shape}:{engine}",
+                "path": path,
+                "size": size,
+                "options": {"engine": engine},
+            }
+        if shape == "tiny":
+            yield {
+                "kind": "guess",
+                "name": f"guess:{name}",
+                "path": path,
+                "size": size,
+                "options": {},
+                "repeat": repeat,
+            }
+        if shape in ("compressible", "many-members"):
+            for args in ([], ["-o", None]):
+                yield {
+                    "kind": "cli",
+                    "name": f"cli{':dir' if args else ''}:{name}:{shape}",
+                    "path": path,
+                    "size": size,
+                    "args": args,
+                    "options": {},
+                }
+
+
+def run(args):
+    directory = args.corpus or tempfile.mkdtemp(prefix="destream-bench-")
+    corpus = build_corpus(directory, args.scale)
+    results = []
+    for spec in iter_specs(corpus, args.engines, args.repeat):
+        if args.filter and args.filter not in spec["name"]:
+            continue
+        best = None
+        for _ in range(args.runs):
+            result = measure(spec)
+            if best is None or result.get("seconds", 0) < best["seconds"]:
+                best = result
+            if "error" in result:
+                best = result
+                break
+        best["name"] = spec["name"]
+        best["size"] = spec["size"]
+        if best.get("seconds") and spec["kind"] != "guess":
+            best["mb_per_s"] = spec["size"] / MB / best["seconds"]
+        results.append(best)
+        sys.stderr.write(format_result(best) + "\n")
+    if not args.corpus:
+        shutil.rmtree(directory)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "scale": args.scale,
+            "seed": SEED,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+def format_result(result):
+    if "error" in result:
+        return f"{result['name']:<45} error {result['error']}"
+    text = f"{result['name']:<45} {result['seconds'] * 1000:10.2f} ms"
+    if "mb_per_s" in result:
+        text += f" {result['mb_per_s']:9.1f} MB/s"
+    if result.get("ttfb") is not None:
+        text += f" ttfb {result['ttfb'] * 1000:8.2f} ms"
+    text += f" rss {result['peak_rss_kib'] / 1024:7.1f} MiB"
+    return text
+
+
+def compare(before, after):
+    with open(before) as fh:
+        before = {x["name"]: x for x in json.load(fh)["results"]}
+    with open(after) as fh:
+        after = json.load(fh)["results"]
+    for result in after:
+        previous = before.get(result["name"])
+        if not previous or "seconds" not in previous or "error" in result:
+            continue
+        ratio = result["seconds"] / previous["seconds"]
+        rss = result["peak_rss_kib"] / previous["peak_rss_kib"]
+        print(
+            f"{result['name']:<45} time x{ratio:5.2f} rss x{rss:5.2f}"
+            + ("  <-- slower" if ratio > 1.1 else "")
+        )
+
+
+parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+parser.add_argument("--output", "-o", help="JSON file of the results")
+parser.add_argument(
+    "--scale",
+    type=float,
+    default=1.0,
+    help="Factor applied to the size of the corpora (1.0: 64 MiB)",
+)
+parser.add_argument(
+    "--corpus", help="Directory where the corpus is kept (temporary)"
+)
+parser.add_argument(
+    "--engines",
+    nargs="+",
+    default=["internal", "external"],
+    help="Engines measured",
+)
+parser.add_argument(
+    "--runs", type=int, default=3, help="Number of runs (the best is kept)"
+)
+parser.add_argument(
+    "--repeat", type=int, default=100, help="Number of guesses measured"
+)
+parser.add_argument("--filter", help="Only run the cases matching")
+parser.add_argument(
+    "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare results"
+)
+parser.add_argument("--case", help=argparse.SUPPRESS)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    if args.case:
+        json.dump(run_case(json.loads(args.case)), sys.stdout)
+    elif args.compare:
+        compare(*args.compare)
+    else:
+        run(args)
@@ -1,4 +1,7 @@
 from destream.archive import *
 from destream.helpers import *
 from destream.decompressors import *
+from destream.sniffer import *
+from destream.cache import *
 from destream.guesser import *
+from destream.aio import *
@@ -0,0 +1,463 @@
+import asyncio
+import inspect
+import io
+import os
+import time
+from asyncio.subprocess import DEVNULL, PIPE
+
+from destream.archive import _current_hooks, _emit
+from destream.decompressors import builtin_decompressors
+from destream.helpers import CHUNK_SIZE, ExternalPipe, _regular_file
+from destream.guesser import Guesser
+
+__all__ = """
+          AsyncArchive AsyncGuesser aopen
+          """.split()
+
+
+class AsyncArchive:
+    """
+    Base class of the layers of an asynchronous stream
+
+    read(), readexactly() and peek() are coroutines and the chunks of the
+    stream can be iterated with async for. An AsyncArchive is closed with
+    close() or by using it in an async with statement.
+    """
+
+    def __init__(self, name, source=None, decompressor=None):
+        assert (
+            type(self) is not AsyncArchive
+        ), "This class can not be used in standalone"
+        self.realname = name or ""
+        self.source = source
+        # NOTE: the class of the pack (tar, zip, ...) found after the last
+        #       layer, packs are not opened asynchronously
+        self.pack = None
+        self._buffer = bytearray()
+        self._eof = False
+        self._consumed = False
+        self._closed = False
+        if isinstance(source, AsyncArchive):
+            self._decompressors = source._decompressors + [decompressor]
+            self.compressions = list(source.compressions)
+        else:
+            self._decompressors = [type(self)]
+            self.compressions = []
+        if hasattr(decompressor, "_compression"):
+            self.compressions += [decompressor._compression]
+
+    async def _read_chunk(self):
+        """
+        Return the next chunk of the stream, an empty bytes at the end
+        """
+        raise NotImplementedError(
+            f"class {type(self)} does not implement this method"
+        )
+
+    def _handoff(self):
+        """
+        Return a file descriptor from which a command can read the stream
+        itself, None if the stream has to be written to the command
+        """
+        return None
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def _fill(self, size):
+        while len(self._buffer) < size and not self._eof:
+            chunk = await self._read_chunk()
+            if not chunk:
+                self._eof = True
+                break
+            self._buffer += chunk
+
+    async def peek(self, size=1):
+        """
+        Return up to size bytes from the stream without consuming them
+        """
+        await self._fill(size)
+        return bytes(self._buffer[:size])
+
+    async def read(self, size=-1):
+        """
+        Read up to size bytes, until the end of the stream if size is
+        negative
+        """
+        self._consumed = True
+        if size is None or size < 0:
+            chunks = [bytes(self._buffer)]
+            self._buffer.clear()
+            async for chunk in self:
+                chunks.append(chunk)
+            return b"".join(chunks)
+        await self._fill(1 if size else 0)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def readexactly(self, size):
+        """
+        Read exactly size bytes, raise asyncio.IncompleteReadError if the
+        stream ends before
+        """
+        self._consumed = True
+        await self._fill(size)
+        if len(self._buffer) < size:
+            partial = bytes(self._buffer)
+            self._buffer.clear()
+            raise asyncio.IncompleteReadError(partial, size)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self._consumed = True
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            return data
+        if not self._eof:
+            data = await self._read_chunk()
+            if data:
+                return data
+            self._eof = True
+        raise StopAsyncIteration
+
+    async def close(self):
+        self._closed = True
+        if isinstance(self.source, AsyncArchive):
+            await self.source.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+class _AsyncArchiveFile(AsyncArchive):
+    """
+    Make an asynchronous stream from a file-object
+
+    The file-object can have a coroutine read() (asyncio.StreamReader for
+    example) or be a regular file-object: the reads of regular file-objects
+    are done in the default executor of the loop. A regular file that has
+    only been peeked is given as is to the first command.
+    """
+
+    def __init__(self, fileobj=None, name=None, closefd=True):
+        if not fileobj:
+            if not name:
+                raise TypeError("Either name, fileobj must be specified")
+            fileobj = io.FileIO(name)
+        elif not name and hasattr(fileobj, "name"):
+            name = fileobj.name
+        super().__init__(name)
+        self.fileobj = fileobj
+        self.closefd = closefd
+        read = getattr(fileobj, "read", None)
+        self._async = isinstance(
+            fileobj, asyncio.StreamReader
+        ) or inspect.iscoroutinefunction(read)
+        self._read = read if self._async else getattr(fileobj, "read1", read)
+        self._offset = None
+        if not self._async:
+            try:
+                self._offset = fileobj.tell()
+            except (AttributeError, OSError):
+                pass
+
+    async def _read_chunk(self):
+        if self._async:
+            return await self._read(CHUNK_SIZE)
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self._read, CHUNK_SIZE
+        )
+
+    def _handoff(self):
+        if self._async or self._consumed or self._offset is None:
+            return None
+        fd = _regular_file(self.fileobj)
+        if fd is None:
+            return None
+        # NOTE: the peeked bytes are read again by the command, the
+        #       file-object must not be read anymore as the file offset is
+        #       shared
+        os.lseek(fd, self._offset, os.SEEK_SET)
+        self._consumed = True
+        return fd
+
+    async def close(self):
+        if not self._closed and self.closefd and not self._async:
+            self.fileobj.close()
+        await super().close()
+
+
+class _AsyncExternalPipe(AsyncArchive):
+    """
+    Pipe an asynchronous stream to the command of an ExternalPipe class
+    using asyncio.create_subprocess_exec, the input is written by a task
+    """
+
+    def __init__(self, decompressor, name, source):
+        super().__init__(name, source=source, decompressor=decompressor)
+        self.command = decompressor._command
+        self.p = None
+        self._writer = None
+        # NOTE: set by the guesser, the hooks can not be found from the
+        #       thread as the coroutines of the event loop share it
+        self._hooks = ()
+        self._exit_reported = False
+
+    async def _start(self):
+        fd = self.source._handoff()
+        self.p = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=PIPE if fd is None else fd,
+            stdout=PIPE,
+            stderr=DEVNULL,
+        )
+        if self._hooks:
+            _emit(
+                self._hooks,
+                "subprocess_spawned",
+                archive=self,
+                command=list(self.command),
+                pid=self.p.pid,
+            )
+        if fd is None:
+            self._writer = asyncio.ensure_future(self._write())
+
+    async def _wait(self):
+        await self.p.wait()
+        # NOTE: the returncode may be set by the child watcher before, the
+        #       exit is reported once by the first wait
+        if self._hooks and not self._exit_reported:
+            self._exit_reported = True
+            _emit(
+                self._hooks,
+                "subprocess_exited",
+                archive=self,
+                pid=self.p.pid,
+                returncode=self.p.returncode,
+                cpu_seconds=None,
+            )
+
+    async def _write(self):
+        try:
+            async for chunk in self.source:
+                self.p.stdin.write(chunk)
+                await self.p.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # NOTE: the command does not need the remaining input
+            pass
+        finally:
+            self.p.stdin.close()
+
+    async def _read_chunk(self):
+        data = await self.p.stdout.read(CHUNK_SIZE)
+        if not data:
+            if self._writer is not None:
+                # NOTE: raise the errors of the previous layers
+                await self._writer
+            await self._wait()
+        return data
+
+    async def close(self):
+        if not self._closed:
+            if self._writer is not None and not self._writer.done():
+                self._writer.cancel()
+                try:
+                    await self._writer
+                except (asyncio.CancelledError, OSError):
+                    pass
+            if self.p is not None:
+                if self.p.returncode is None:
+                    self.p.kill()
+                await self._wait()
+        await super().close()
+
+
+class _AsyncDecompressor(AsyncArchive):
+    """
+    Decompress an asynchronous stream using the in-process decompressor of
+    an ExternalPipe class, like _DecompressorReader: the decompression is
+    done in the default executor of the loop to not block it
+    """
+
+    def __init__(self, decompressor, name, source):
+        super().__init__(name, source=source, decompressor=decompressor)
+        self.decompressobj = decompressor._decompressobj
+        magic = decompressor._magic
+        self.magic = (magic,) if isinstance(magic, bytes) else magic
+        self.padding = decompressor._padding
+        self._decompressor = self.decompressobj()
+        self._pending = b""
+
+    async def _next_member(self):
+        data = self._decompressor.unused_data
+        if self.magic is None:
+            return False
+        while True:
+            while len(data) < max(map(len, self.magic)):
+                chunk = await self.source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+            if not self.padding:
+                break
+            size = len(data) - len(data.lstrip(b"\0"))
+            size -= size % self.padding
+            if not size:
+                break
+            data = data[size:]
+        if not data.startswith(self.magic):
+            return False
+        self._decompressor = self.decompressobj()
+        self._pending = data
+        return True
+
+    async def _read_chunk(self):
+        while True:
+            if self._decompressor.eof and not await self._next_member():
+                return b""
+            if self._decompressor.needs_input:
+                data, self._pending = (
+                    self._pending or await self.source.read(CHUNK_SIZE),
+                    b"",
+                )
+                if not data:
+                    raise EOFError(
+                        "compressed file ended before the end-of-stream "
+                        "marker was reached"
+                    )
+            else:
+                data = b""
+            output = await asyncio.get_event_loop().run_in_executor(
+                None, self._decompressor.decompress, data, CHUNK_SIZE
+            )
+            if output:
+                return output
+
+
+class AsyncGuesser(Guesser):
+    """
+    Make an asynchronous stream using the decompressors given in the
+    constructor, see Guesser
+
+    Only the compressions (ExternalPipe classes) are applied: the commands
+    run with asyncio.create_subprocess_exec, the in-process decompressors
+    and the reads of regular file-objects run in the default executor of the
+    loop (a pool of threads) so they do not block it. The options of the
+    decompressors other than engine are ignored. When the stream is a pack
+    (tar, zip, ...), its class is set to the pack attribute of the last
+    layer. The reads of the layers are not reported to the hooks.
+    """
+
+    async def _try_async(self, decompressor, mime, archive, options, hooks):
+        if hooks:
+            _emit(
+                hooks,
+                "decompressor_tried",
+                archive=archive,
+                decompressor=decompressor,
+            )
+        try:
+            realname = decompressor._guess(
+                mime, str(archive.realname), archive
+            )
+        except ValueError as exc:
+            return self._reject(hooks, archive, decompressor, exc)
+        if not issubclass(decompressor, ExternalPipe):
+            archive.pack = decompressor
+            return archive
+        kwargs = {
+            k: v
+            for k, v in self._options_for(decompressor, options).items()
+            if k == "engine"
+        }
+        start = time.perf_counter()
+        self._check_availability(decompressor, kwargs)
+        if decompressor._select_engine(kwargs.get("engine")) == "internal":
+            guessed = _AsyncDecompressor(decompressor, realname, archive)
+        else:
+            guessed = _AsyncExternalPipe(decompressor, realname, archive)
+            guessed._hooks = hooks
+            await guessed._start()
+        if hooks:
+            _emit(
+                hooks,
+                "layer_opened",
+                archive=guessed,
+                source=archive,
+                decompressor=decompressor,
+                seconds=time.perf_counter() - start,
+            )
+        return guessed
+
+    async def guess(self, archive, **options):
+        options = dict(self.options, **options)
+        hooks = _current_hooks() + tuple(self.hooks)
+        start = time.perf_counter()
+        mime = self.mime(await archive.peek(1024))
+        if hooks:
+            _emit(
+                hooks,
+                "mime",
+                archive=archive,
+                mime=mime,
+                seconds=time.perf_counter() - start,
+            )
+        key, candidates = self._candidates(mime, archive)
+        for decompressor in candidates:
+            guessed = await self._try_async(
+                decompressor, mime, archive, options, hooks
+            )
+            if guessed is not None:
+                self._cache_set(key, decompressor)
+                return None if guessed is archive else guessed
+        self._cache_set(key, None)
+        return None
+
+    async def open(self, name=None, fileobj=None, closefd=True, **options):
+        hooks = _current_hooks() + tuple(self.hooks)
+        start = time.perf_counter()
+        archive = _AsyncArchiveFile(fileobj, name, closefd=closefd)
+        if hooks:
+            _emit(
+                hooks,
+                "layer_opened",
+                archive=archive,
+                source=None,
+                decompressor=None,
+                seconds=time.perf_counter() - start,
+            )
+
+        for i in range(self.limit):
+            guessed = await self.guess(archive, **options)
+            if not guessed:
+                return archive
+            archive = guessed
+
+        raise Exception("More than 10 pipes or infinite loop detected")
+
+
+_guesser = None
+
+
+async def aopen(name=None, fileobj=None, closefd=True, **options):
+    """
+    Use all decompressor possible to make an asynchronous stream
+    """
+    global _guesser
+    # NOTE: like open(), follow the changes of builtin_decompressors
+    if _guesser is None or _guesser.decompressors != builtin_decompressors:
+        _guesser = AsyncGuesser()
+    return await _guesser.open(
+        name=name, fileobj=fileobj, closefd=closefd, **options
+    )
@@ -1,20 +1,148 @@
 import re
 import os
 import io
+import threading
+import time
+import weakref
 
 __all__ = """
-          Archive ArchivePack
+          Archive ArchivePack add_hook remove_hook
           """.split()
 
 
 RE_EXTENSION = re.compile(r"^(.*?)(\.([^.]+))?$")
 
+# NOTE: count_reads is set by the guesser when the option stats is used,
+#       the reads of the archives made meanwhile (in the thread) are counted,
+#       hooks is set to the hooks of the guesser while it opens a file
+_local = threading.local()
+_hooks = []
+
+
+def add_hook(hook):
+    """
+    Register a function called with every event of destream, in any thread
+    (use Guesser.add_hook() to register it for the files opened by a
+    guesser only)
+
+    The hook is called with a dict holding the name of the event (event),
+    its time given by time.monotonic() (time) and the fields of the event:
+
+    mime: archive, mime, seconds
+    decompressor_tried: archive, decompressor
+    decompressor_rejected: archive, decompressor, reason
+    layer_opened: archive, source, decompressor, seconds
+    layer_closed: archive, bytes, read_calls
+    subprocess_spawned: archive, command, pid
+    subprocess_exited: archive, pid, returncode, cpu_seconds
+    spool_started: archive, source
+    spool_finished: archive, source, bytes, seconds
+    read: archive, bytes, seconds
+
+    The hooks are bound to the archives when they are made: the reads of an
+    archive made while no hook is registered are not reported. The events
+    are emitted from the thread doing the work, exceptions raised by a hook
+    are propagated.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def _current_hooks():
+    """
+    Return the hooks of the events of this thread, an empty tuple if there
+    is none
+    """
+    return tuple(_hooks) + getattr(_local, "hooks", ())
+
+
+def _emit(hooks, event, **fields):
+    event = dict(event=event, time=time.monotonic(), **fields)
+    for hook in hooks:
+        hook(event)
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    Raw stream counting the reads of a file-object and the time spent in
+    them, each read is reported to the hooks (if any) as a read event of the
+    archive
+    """
+
+    def __init__(self, raw, archive=None, hooks=()):
+        super().__init__()
+        self.raw = raw
+        self.calls = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self._readinto = getattr(raw, "readinto", None)
+        self._hooks = hooks
+        # NOTE: the archive holds the reader
+        self._archive = weakref.ref(archive) if archive is not None else None
+
+    @property
+    def name(self):
+        return self.raw.name
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return self.raw.seekable()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.raw.seek(offset, whence)
+
+    def tell(self):
+        return self.raw.tell()
+
+    def fileno(self):
+        return self.raw.fileno()
+
+    def readinto(self, b):
+        start = time.perf_counter()
+        if self._readinto is not None:
+            size = self._readinto(b)
+        else:
+            data = self.raw.read(len(b))
+            size = len(data)
+            b[:size] = data
+        seconds = time.perf_counter() - start
+        self.seconds += seconds
+        self.calls += 1
+        if size:
+            self.bytes += size
+        if self._hooks:
+            _emit(
+                self._hooks,
+                "read",
+                archive=self._archive(),
+                bytes=size or 0,
+                seconds=seconds,
+            )
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
 
 class Archive(io.BufferedReader):
     """
     Base class to Archive file
     """
 
+    _counter = None
+    _hooks = ()
+    _close_reported = False
+    # NOTE: seconds spent by the guesser to make the archive, set by the
+    #       guesser
+    _timings = None
+
     def __init__(self, name, fileobj=None, source=None, closefd=True):
         assert (
             type(self) != Archive
@@ -28,6 +156,10 @@ class Archive(io.BufferedReader):
             f"fileobj must be an instance of io.IOBase or a file, "
             f"got {type(fileobj)}"
         )
+        hooks = _current_hooks()
+        if hooks or getattr(_local, "count_reads", False):
+            self._hooks = hooks
+            fileobj = self._counter = _CountingReader(fileobj, self, hooks)
         io.BufferedReader.__init__(self, fileobj)
         self.realname = name or ""
         self.source = source
@@ -42,7 +174,7 @@ class Archive(io.BufferedReader):
             self.compressions += [self._compression]
 
     @classmethod
-    def _check_availability(cls):
+    def _check_availability(cls, **options):
         pass
 
     @classmethod
@@ -69,9 +201,58 @@ class Archive(io.BufferedReader):
         return realname
 
     def close(self):
+        if self._hooks and not self._close_reported:
+            self._close_reported = True
+            _emit(
+                self._hooks,
+                "layer_closed",
+                archive=self,
+                bytes=self._counter.bytes,
+                read_calls=self._counter.calls,
+            )
         if getattr(self, "closefd", True):
             super().close()
 
+    def _stats(self):
+        stats = {
+            "layer": type(self).__name__,
+            "name": str(self.realname),
+            "bytes_in": None,
+            "bytes_out": None,
+            "read_calls": None,
+            "read_seconds": None,
+        }
+        if self._counter is not None:
+            stats["bytes_out"] = self._counter.bytes
+            stats["read_calls"] = self._counter.calls
+            stats["read_seconds"] = self._counter.seconds
+        stats.update(self._timings or {})
+        return stats
+
+    def stats(self):
+        """
+        Return the statistics of the layers of the stream, from the file to
+        this archive: a list of dicts with the class of the layer (layer),
+        its name, the bytes read from the previous layer (bytes_in) and
+        given to the next one (bytes_out), the number of reads and the
+        seconds spent in them (read_calls, read_seconds), the seconds spent
+        by the guesser (guess, check_availability, init), the bytes written
+        to temporary files (spooled, spool_seconds) and the CPU time of the
+        commands (cpu_seconds). The reads are only counted when the archive
+        is opened with the option stats=True, the reads of the members of
+        a pack are not counted in the pack.
+        """
+        layers = []
+        archive = self
+        while isinstance(archive, Archive):
+            layers.append(archive._stats())
+            archive = archive.source
+        layers.reverse()
+        for previous, layer in zip(layers, layers[1:]):
+            if layer["bytes_in"] is None:
+                layer["bytes_in"] = previous["bytes_out"]
+        return layers
+
 
 class ArchivePack(Archive):
     """
@@ -89,6 +270,13 @@ class ArchivePack(Archive):
             f"class {type(self)} does not implement this method"
         )
 
+    def iter_members(self):
+        """
+        Iterate over the members and their streams: (member, stream)
+        """
+        for member in self.members():
+            yield member, self.open(member)
+
     def open(self, member):
         raise NotImplementedError(
             f"class {type(self)} does not implement this method"
@@ -99,7 +287,12 @@ class ArchivePack(Archive):
             f"class {type(self)} does not implement this method"
         )
 
-    def extractall(self, path, members=None):
+    def extractall(self, path, members=None, workers=None):
+        """
+        Extract the members (all by default) to path, with workers the
+        independent members are extracted on a pool of workers (a number of
+        threads or an instance of concurrent.futures.ThreadPoolExecutor)
+        """
         raise NotImplementedError(
             f"class {type(self)} does not implement this method"
         )
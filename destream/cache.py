@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import stat
+import tempfile
+
+from destream.helpers import CHUNK_SIZE, ArchiveMmap, _buffered_layers
+
+__all__ = """
+          ListingCache
+          """.split()
+
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+
+def default_path():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "destream", "listings")
+
+
+class ListingCache:
+    """
+    On-disk cache of the listings of the archives that are costly to list
+    (7z, rar), give it to the guesser with the listing_cache option
+
+    The listings are stored as JSON files in path, the least recently used
+    are removed when the total size exceeds max_size.
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_path()
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def file_key(fileobj):
+        """
+        Return the identity of a regular file (device, inode, size,
+        modification time and position), None if the file-object is not a
+        regular file
+        """
+        stack = _buffered_layers(fileobj)
+        if isinstance(fileobj, ArchiveMmap):
+            stack = [], fileobj.fileno()
+        if stack is None:
+            return None
+        try:
+            st = os.fstat(stack[1])
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            position = fileobj.tell()
+        except OSError:
+            return None
+        return (
+            f"file:{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+            f":{position}"
+        )
+
+    @staticmethod
+    def content_key(fileobj):
+        """
+        Return the hash of the content of a seekable file-object, from its
+        beginning
+        """
+        position = fileobj.tell()
+        fileobj.seek(0)
+        digest = hashlib.sha256()
+        buffer = memoryview(bytearray(CHUNK_SIZE))
+        while True:
+            size = fileobj.readinto(buffer)
+            if not size:
+                break
+            digest.update(buffer[:size])
+        fileobj.seek(position)
+        return "sha256:" + digest.hexdigest()
+
+    def _filename(self, namespace, key):
+        name = hashlib.sha256(f"{namespace}\0{key}".encode()).hexdigest()
+        return os.path.join(self.path, name + ".json")
+
+    def get(self, namespace, key):
+        """
+        Return the listing stored for the key, None if there is none
+        """
+        filename = self._filename(namespace, key)
+        try:
+            with open(filename, encoding="utf-8") as fh:
+                value = json.load(fh)
+            # NOTE: the modification time is the time of the last use
+            os.utime(filename)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def set(self, namespace, key, value):
+        filename = self._filename(namespace, key)
+        fd, tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(value, fh)
+            os.replace(tmpname, filename)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".json"):
+                os.unlink(entry.path)
@@ -1,13 +1,163 @@
+import bz2
+
 from destream import ExternalPipe
 
 __all__ = ["Bunzip2"]
 
 
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+READ_SIZE = 1024 * 1024
+
+
+def _patterns(magic):
+    # NOTE: the magics are not byte aligned, for each of the 8 possible bit
+    #       shifts, the 5 bytes in the middle of the magic are always known
+    return [
+        (((magic << (8 - shift)).to_bytes(7, "big")[1:6]), shift)
+        for shift in range(8)
+    ]
+
+
+PATTERNS = [
+    (magic, pattern, shift)
+    for magic in (BLOCK_MAGIC, EOS_MAGIC)
+    for pattern, shift in _patterns(magic)
+]
+
+
+def _bits(data, start, count):
+    first = start // 8
+    last = (start + count + 7) // 8
+    value = int.from_bytes(data[first:last], "big")
+    return (value >> (last * 8 - start - count)) & ((1 << count) - 1)
+
+
+def _find_magic(data, start):
+    """
+    Return the bit position of the first block or end of stream magic found
+    from the bit position start, None if there is none
+    """
+    found = None
+    for magic, pattern, shift in PATTERNS:
+        pos = data.find(pattern, max(start // 8, 1))
+        while pos != -1:
+            bit = (pos - 1) * 8 + shift
+            if found is not None and bit >= found:
+                break
+            if (
+                bit >= start
+                and bit + 48 <= len(data) * 8
+                and _bits(data, bit, 48) == magic
+            ):
+                found = bit
+                break
+            pos = data.find(pattern, pos + 1)
+    return found
+
+
+def _make_stream(data, start, end, crc, level):
+    # NOTE: a stream made of a single block has a combined CRC equal to the
+    #       CRC of the block
+    size = end - start
+    value = _bits(data, start, size) << 80 | EOS_MAGIC << 32 | crc
+    padding = -(size + 80) % 8
+    return (
+        b"BZh"
+        + level
+        + (value << padding).to_bytes((size + 80 + padding) // 8, "big")
+    )
+
+
+def iter_blocks(fileobj, read_size=READ_SIZE):
+    """
+    Iterate over the blocks of a bzip2 file-object, each block is returned
+    as an independent bzip2 stream. Trailing garbage is ignored like bunzip2
+    does.
+    """
+    data = bytearray()
+    eof = False
+
+    def fill():
+        nonlocal eof
+        chunk = fileobj.read(read_size)
+        if not chunk:
+            eof = True
+        data.extend(chunk)
+        return not eof
+
+    # NOTE: pos is a bit position in data, it is byte aligned at the
+    #       beginning of a stream
+    pos = 0
+    while True:
+        while len(data) < pos // 8 + 4 and fill():
+            pass
+        header = bytes(data[pos // 8 : pos // 8 + 4])
+        if (
+            len(header) < 4
+            or header[:3] != b"BZh"
+            or header[3:4] not in b"123456789"
+        ):
+            return
+        level = header[3:4]
+        pos += 32
+        combined = 0
+        while True:
+            while len(data) * 8 < pos + 80 and fill():
+                pass
+            if len(data) * 8 < pos + 80:
+                raise EOFError(
+                    "compressed file ended before the end-of-stream marker "
+                    "was reached"
+                )
+            magic = _bits(data, pos, 48)
+            crc = _bits(data, pos + 48, 32)
+            if magic == EOS_MAGIC:
+                if crc != combined:
+                    raise OSError("bzip2: invalid stream CRC")
+                pos += 80 + -(pos + 80) % 8
+                break
+            if magic != BLOCK_MAGIC:
+                raise OSError("bzip2: invalid block magic")
+            search = pos + 48
+            while True:
+                end = _find_magic(data, search)
+                if end is not None:
+                    break
+                search = max(search, (len(data) - 7) * 8)
+                if not fill():
+                    raise EOFError(
+                        "compressed file ended before the end-of-stream "
+                        "marker was reached"
+                    )
+            yield _make_stream(data, pos, end, crc, level)
+            combined = ((combined << 1 | combined >> 31) & 0xFFFFFFFF) ^ crc
+            del data[: end // 8]
+            pos = end % 8
+
+
 class Bunzip2(ExternalPipe):
+    """
+    Decompress bzip2
+
+    With workers, the blocks are located using their magic and decompressed
+    in parallel.
+    """
+
     _mimes = ["application/x-bzip2"]
     _extensions = ["bz2", "bz", "tbz2", "tbz"]
     _command = ["bunzip2"]
     _compression = "bzip2"
+    _magic = b"BZh"
+    _options = ExternalPipe._options + ["workers", "max_memory"]
+    _decompress_chunk = staticmethod(bz2.decompress)
+
+    @staticmethod
+    def _decompressobj():
+        return bz2.BZ2Decompressor()
+
+    def _iter_chunks(self, stdin):
+        return iter_blocks(stdin)
 
     @classmethod
     def _guess(cls, mime, name, fileobj):
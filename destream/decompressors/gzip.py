@@ -1,9 +1,332 @@
-from destream import ExternalPipe
+import bisect
+import errno
+import io
+import json
+import os
+import struct
+import zlib
+
+from destream import ExternalPipe, make_seekable
+from destream.helpers import CHUNK_SIZE, ZlibDecompressor
 
 __all__ = ["Gunzip"]
 
 
+MAGIC = b"\x1f\x8b"
+FEXTRA = 4
+# NOTE: members are grouped to amortize the cost of dispatching them to the
+#       workers (BGZF blocks are at most 64 KiB)
+BATCH_SIZE = 1024 * 1024
+CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+INDEX_VERSION = 1
+
+
+def bgzf_block_size(extra):
+    """
+    Return the total size of the member given by the BGZF subfield (BC) of
+    the extra field of a gzip header, None if there is no such subfield
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        si, length = (
+            extra[pos : pos + 2],
+            extra[pos + 2] + extra[pos + 3] * 256,
+        )
+        if si == b"BC" and length == 2:
+            (bsize,) = struct.unpack("<H", extra[pos + 4 : pos + 6])
+            return bsize + 1
+        pos += 4 + length
+    return None
+
+
+def is_bgzf(header):
+    if len(header) < 12 or header[:2] != MAGIC or not header[3] & FEXTRA:
+        return False
+    (xlen,) = struct.unpack("<H", header[10:12])
+    return bgzf_block_size(header[12 : 12 + xlen]) is not None
+
+
+def iter_members(fileobj):
+    """
+    Iterate over the members of a gzip file-object. The end of a member is
+    given by the block size of BGZF members, the other members have to be
+    inflated to find their end. Trailing garbage is ignored like gunzip does.
+    """
+    buffer = b""
+
+    def read(size):
+        nonlocal buffer
+        while len(buffer) < size:
+            chunk = fileobj.read(max(size - len(buffer), CHUNK_SIZE))
+            if not chunk:
+                break
+            buffer += chunk
+        data, buffer = buffer[:size], buffer[size:]
+        return data
+
+    while True:
+        header = read(12)
+        if len(header) < 12 or header[:2] != MAGIC:
+            return
+        size = None
+        if header[3] & FEXTRA:
+            (xlen,) = struct.unpack("<H", header[10:12])
+            header += read(xlen)
+            size = bgzf_block_size(header[12:])
+        if size is not None:
+            member = header + read(size - len(header))
+            if len(member) < size:
+                raise EOFError(
+                    "compressed file ended before the end of the member"
+                )
+            yield member
+            continue
+        decompressobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        member = [header]
+        data = header
+        while True:
+            decompressobj.decompress(data)
+            if decompressobj.eof:
+                break
+            data = read(CHUNK_SIZE)
+            if not data:
+                raise EOFError(
+                    "compressed file ended before the end-of-stream marker "
+                    "was reached"
+                )
+            member.append(data)
+        unused = decompressobj.unused_data
+        if unused:
+            member[-1] = member[-1][: -len(unused)]
+            buffer = unused + buffer
+        yield b"".join(member)
+
+
+def iter_batches(members, size=BATCH_SIZE):
+    batch = []
+    batch_size = 0
+    for member in members:
+        batch.append(member)
+        batch_size += len(member)
+        if batch_size >= size:
+            yield b"".join(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        yield b"".join(batch)
+
+
+def decompress_members(data):
+    output = []
+    while data:
+        decompressobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        output.append(decompressobj.decompress(data))
+        data = decompressobj.unused_data
+    return b"".join(output)
+
+
+class SeekableGzipReader(io.RawIOBase):
+    """
+    Raw stream decompressing a seekable gzip file-object with random access
+
+    While decompressing, a checkpoint is taken every interval bytes of
+    output: a copy of the decompressor (which holds the 32 KiB window) in
+    the middle of a member, or just the position of the member when a member
+    starts close enough. A seek restarts from the closest checkpoint before
+    the position. The checkpoints at the start of the members do not depend
+    on the state of the decompressor, they are saved to the index file (if
+    any) and loaded the next time the file is opened.
+    """
+
+    def __init__(self, fileobj, interval=CHECKPOINT_INTERVAL, index=None):
+        super().__init__()
+        self.fileobj = fileobj
+        self.interval = interval
+        self.index = index
+        self._start = fileobj.tell()
+        # NOTE: (output offset, input offset, decompressor or None), the
+        #       output offsets are kept in a separate list for bisect
+        self._checkpoints = [(0, self._start, None)]
+        self._offsets = [0]
+        self._size = None
+        self._pos = 0
+        if index is not None:
+            self._load_index()
+        self._restore(self._checkpoints[0])
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _identity(self):
+        try:
+            st = os.fstat(self.fileobj.fileno())
+        except (OSError, AttributeError):
+            return None
+        return [st.st_size, st.st_mtime_ns, self._start, self.interval]
+
+    def _load_index(self):
+        try:
+            with open(self.index, encoding="utf-8") as fh:
+                index = json.load(fh)
+        except (OSError, ValueError):
+            return
+        identity = self._identity()
+        if (
+            identity is None
+            or index.get("version") != INDEX_VERSION
+            or index.get("identity") != identity
+        ):
+            return
+        self._checkpoints = [(x, y, None) for x, y in index["checkpoints"]]
+        self._offsets = [x for x, _ in index["checkpoints"]]
+        self._size = index["size"]
+
+    def _save_index(self):
+        identity = self._identity()
+        if self.index is None or identity is None:
+            return
+        index = {
+            "version": INDEX_VERSION,
+            "identity": identity,
+            "size": self._size,
+            "checkpoints": [
+                [x, y] for x, y, state in self._checkpoints if state is None
+            ],
+        }
+        try:
+            with open(self.index, "w", encoding="utf-8") as fh:
+                json.dump(index, fh)
+        except OSError:
+            # NOTE: the index is only an optimization
+            pass
+
+    def _restore(self, checkpoint):
+        self._out, self._in, state = checkpoint
+        if state is None:
+            self._decompressor = ZlibDecompressor(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = state.copy()
+        self._pending = b""
+        self._eof = False
+
+    def _add_checkpoint(self, distance, member_start=False):
+        """
+        Add a checkpoint at the current position if the previous one is at
+        least distance bytes before, return the number of bytes that can be
+        decompressed before the next checkpoint
+        """
+        i = bisect.bisect_right(self._offsets, self._out) - 1
+        if self._out - self._offsets[i] >= distance:
+            state = None if member_start else self._decompressor.copy()
+            checkpoint = (self._out, self._in - len(self._pending), state)
+            self._checkpoints.insert(i + 1, checkpoint)
+            self._offsets.insert(i + 1, self._out)
+            i += 1
+        return self._offsets[i] + self.interval - self._out
+
+    def _next_member(self):
+        data = self._decompressor.unused_data
+        self.fileobj.seek(self._in)
+        while len(data) < len(MAGIC):
+            chunk = self.fileobj.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self._in += len(chunk)
+            data += chunk
+        if not data.startswith(MAGIC):
+            # NOTE: trailing garbage is ignored like gunzip does
+            self._eof = True
+            if self._size is None:
+                self._size = self._out
+                self._save_index()
+            return False
+        self._decompressor = ZlibDecompressor(16 + zlib.MAX_WBITS)
+        self._pending = data
+        self._add_checkpoint(self.interval // 2, member_start=True)
+        return True
+
+    def _decompress(self, size):
+        while not self._eof:
+            if self._decompressor.eof:
+                if not self._next_member():
+                    break
+                continue
+            size = min(size, self._add_checkpoint(self.interval))
+            data = b""
+            if self._decompressor.needs_input:
+                data, self._pending = self._pending, b""
+                if not data:
+                    self.fileobj.seek(self._in)
+                    data = self.fileobj.read(CHUNK_SIZE)
+                    self._in += len(data)
+                    if not data:
+                        raise EOFError(
+                            "compressed file ended before the end-of-stream "
+                            "marker was reached"
+                        )
+            output = self._decompressor.decompress(data, size)
+            if output:
+                self._out += len(output)
+                return output
+        return b""
+
+    def _move(self, pos):
+        i = bisect.bisect_right(self._offsets, pos) - 1
+        if self._out > pos or self._offsets[i] > self._out:
+            self._restore(self._checkpoints[i])
+        while self._out < pos:
+            if not self._decompress(min(pos - self._out, CHUNK_SIZE)):
+                break
+
+    def readinto(self, b):
+        if len(b) == 0:
+            return 0
+        if self._out != self._pos:
+            self._move(self._pos)
+            if self._out != self._pos:
+                return 0
+        data = self._decompress(len(b))
+        self._pos += len(data)
+        b[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            if self._size is None:
+                self._move(self._offsets[-1])
+                while self._decompress(CHUNK_SIZE):
+                    pass
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise OSError(errno.EINVAL, "negative seek position")
+        self._pos = pos
+        return pos
+
+
 class Gunzip(ExternalPipe):
+    """
+    Decompress gzip
+
+    With workers, the members of BGZF files (bgzip, samtools, ...) are
+    decompressed in parallel. Other gzip files are decompressed sequentially.
+
+    With seekable, the output can be read at any position, see
+    SeekableGzipReader. index is the path of the file where the checkpoints
+    are saved, True for the name of the file followed by ".gzidx".
+    """
+
     _mimes = [
         "application/x-gzip",
         "application/gzip",
@@ -11,6 +334,70 @@ class Gunzip(ExternalPipe):
     _extensions = ["gz"]
     _command = ["gunzip"]
     _compression = "gzip"
+    _magic = MAGIC
+    _options = ExternalPipe._options + [
+        "workers",
+        "max_memory",
+        "seekable",
+        "checkpoint_interval",
+        "index",
+    ]
+    _decompress_chunk = staticmethod(decompress_members)
+
+    def __init__(
+        self,
+        name,
+        stdin,
+        engine=None,
+        workers=None,
+        max_memory=None,
+        seekable=False,
+        checkpoint_interval=CHECKPOINT_INTERVAL,
+        index=None,
+    ):
+        self._random_access = seekable
+        if seekable:
+            # NOTE: a command can not restart from a checkpoint
+            if engine == "external":
+                raise OSError(
+                    errno.ENOSYS,
+                    f"{type(self).__name__}: the external engine can not "
+                    f"seek",
+                )
+            engine = "internal"
+            if index is True:
+                path = getattr(stdin, "name", None)
+                if isinstance(path, (str, os.PathLike)):
+                    index = os.fspath(path) + ".gzidx"
+                else:
+                    index = None
+            self._index = index
+            self._checkpoint_interval = checkpoint_interval
+        super().__init__(
+            name,
+            stdin,
+            engine=engine,
+            workers=workers,
+            max_memory=max_memory,
+        )
+
+    def _open_internal(self, stdin):
+        if self._random_access:
+            return SeekableGzipReader(
+                make_seekable(stdin),
+                interval=self._checkpoint_interval,
+                index=self._index,
+            )
+        return super()._open_internal(stdin)
+
+    @staticmethod
+    def _decompressobj():
+        return ZlibDecompressor(16 + zlib.MAX_WBITS)
+
+    def _iter_chunks(self, stdin):
+        if not hasattr(stdin, "peek") or not is_bgzf(stdin.peek(18)):
+            return None
+        return iter_batches(iter_members(stdin))
 
     @classmethod
     def _guess(cls, mime, name, fileobj):
@@ -1,3 +1,8 @@
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
 from destream import ExternalPipe
 
 __all__ = ["Unlzma"]
@@ -8,3 +13,9 @@ class Unlzma(ExternalPipe):
     _extensions = ["lzma"]
     _command = "unlzma -c".split()
     _compression = "lzma"
+
+    if lzma is not None:
+
+        @staticmethod
+        def _decompressobj():
+            return lzma.LZMADecompressor(lzma.FORMAT_ALONE)
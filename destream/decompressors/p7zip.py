@@ -1,18 +1,20 @@
 import struct
 import binascii
 import re
-from functools import reduce
-from subprocess import check_output, Popen, PIPE, CalledProcessError
+from functools import partial, reduce
+from subprocess import Popen, PIPE, CalledProcessError
 
 from destream import ArchivePack, ArchiveTemp, ExternalPipe
+from destream.helpers import (
+    _LazyList,
+    _iter_command_lines,
+    _iter_command_members,
+    _iter_hunks,
+)
 
 __all__ = ["Un7z"]
 
 
-ereg_header = re.compile("^" + r"--+\n(.+?)(?=\n\n)", re.M + re.S)
-ereg_member = re.compile("^" + r"(.+?)(?=\n\n)", re.M + re.S)
-
-
 def parse_hunk(hunk):
     info = {}
     for m in re.finditer(
@@ -54,32 +56,50 @@ class Member:
         return self.attributes[0] == "D"
 
 
+def _restore(cls, info):
+    """
+    Make an instance of Header or Member from the information in cache
+    """
+    instance = cls.__new__(cls)
+    instance.__dict__.update(info)
+    return instance
+
+
 class Un7z(ArchivePack):
     _mimes = ["application/x-7z-compressed"]
     _extensions = ["7z"]
     _command = ["7zr"]
     _compression = "7z"
 
+    _options = ["listing_cache"]
+
     @classmethod
-    def _check_availability(cls):
+    def _check_availability(cls, **options):
         return ExternalPipe._check_availability.__func__(cls)
 
-    def __init__(self, name, fileobj):
+    def __init__(self, name, fileobj, listing_cache=None):
+        key = listing_cache and listing_cache.file_key(fileobj)
         self.fileobj = ArchiveTemp(fileobj)
-        info = check_output(
-            self._command + ["l", self.fileobj.name, "-slt"]
-        ).decode()
-        self.header = Header(ereg_header.search(info).group(1))
-        self._members = [
-            Member(m.group(1))
-            for m in ereg_member.finditer(
-                info, re.search("^" + "-" * 10 + "$", info, re.M).end(0)
+        listing = None
+        if listing_cache is not None:
+            key = key or listing_cache.content_key(self.fileobj)
+            listing = listing_cache.get(type(self)._compression, key)
+        if listing is not None:
+            self.header = _restore(Header, listing["header"])
+            self._listing = _LazyList(
+                _restore(Member, x) for x in listing["members"]
             )
-        ]
-        self._stream = len(self._members) == 1
+        else:
+            on_complete = None
+            if listing_cache is not None:
+                on_complete = partial(self._store, listing_cache, key)
+            self._listing = _LazyList(self._list(), on_complete=on_complete)
+        # NOTE: the listing is parsed while it is needed, only the first two
+        #       members are needed to know if the archive holds a single file
+        self._stream = len(self._listing.fill(2)) == 1
         if self._stream:
-            stream = self.open(self._members[0])
-            stream_name = self._members[0].filename
+            stream = self.open(self._listing.items[0])
+            stream_name = self._listing.items[0].filename
             self._compression += ":" + stream_name
         else:
             stream_name = name
@@ -87,8 +107,49 @@ class Un7z(ArchivePack):
             stream.seek(0)
         ArchivePack.__init__(self, stream_name, stream, source=fileobj)
 
+    def _list(self):
+        """
+        Parse the header and iterate over the members while the listing is
+        read
+        """
+        lines = _iter_command_lines(
+            self._command + ["l", self.fileobj.name, "-slt"]
+        )
+        for line in lines:
+            if re.match("^--+$", line):
+                break
+        header = []
+        for line in lines:
+            if not line:
+                break
+            header.append(line)
+        self.header = Header("\n".join(header))
+        for line in lines:
+            if line == "-" * 10:
+                break
+        return (Member(hunk) for hunk in _iter_hunks(lines))
+
+    def _store(self, listing_cache, key, members):
+        listing_cache.set(
+            type(self)._compression,
+            key,
+            {
+                "header": vars(self.header),
+                "members": [vars(x) for x in members],
+            },
+        )
+
     def members(self):
-        return self._members
+        return self._listing.fill()
+
+    def iter_members(self):
+        if self._stream:
+            return super().iter_members()
+        # NOTE: the members are extracted in a single pass, solid blocks are
+        #       not decompressed again for each member
+        return _iter_command_members(
+            self._command + ["e", self.fileobj.name, "-so"], self._listing
+        )
 
     def open(self, member):
         p = Popen(
@@ -107,7 +168,9 @@ class Un7z(ArchivePack):
             return p.stdout
         else:
             try:
-                temp = ArchiveTemp(p.stdout)
+                temp = ArchiveTemp(
+                    p.stdout, size=getattr(member, "size", None)
+                )
                 retcode = p.wait()
                 if retcode:
                     raise CalledProcessError(
@@ -133,6 +196,7 @@ class Un7z(ArchivePack):
                 self._p.wait()
         else:
             self.fileobj.close()
+        self._listing.close()
 
     def extract(self, member, path):
         p = Popen(
@@ -155,12 +219,15 @@ class Un7z(ArchivePack):
         finally:
             p.stdout.close()
 
-    def extractall(self, path, members=None):
+    def extractall(self, path, members=None, workers=None):
         if members is None:
             members = []
+        # NOTE: the command uses its own threads
+        options = [f"-mmt={workers}"] if isinstance(workers, int) else []
         p = Popen(
             self._command
             + ["x", self.fileobj.name, "-y", "-o" + path]
+            + options
             + [(m.filename if isinstance(m, Member) else m) for m in members],
             stdout=PIPE,
         )
@@ -1,11 +1,17 @@
 import struct
 import binascii
 import re
-from functools import reduce
+from functools import partial, reduce
 from subprocess import check_output, Popen, PIPE, CalledProcessError
 from distutils.version import LooseVersion as Version
 
 from destream import ArchivePack, ArchiveTemp, ExternalPipe
+from destream.helpers import (
+    _LazyList,
+    _iter_command_lines,
+    _iter_command_members,
+    _iter_hunks,
+)
 
 __all__ = ["Unrar"]
 
@@ -49,6 +55,15 @@ class Member:
         return self.type == "Directory"
 
 
+def _restore(cls, info):
+    """
+    Make an instance of Header or Member from the information in cache
+    """
+    instance = cls.__new__(cls)
+    instance.__dict__.update(info)
+    return instance
+
+
 class Unrar(ArchivePack):
     _mimes = ["application/x-rar"]
     _extensions = ["rar"]
@@ -61,8 +76,10 @@ class Unrar(ArchivePack):
     #   available.
     __fallbackcommands__ = ["unrar"]
 
+    _options = ["listing_cache"]
+
     @classmethod
-    def _check_availability(cls):
+    def _check_availability(cls, **options):
         ExternalPipe._check_availability.__func__(cls)
         output = check_output(cls._command).decode()
         matches = re.search(r"(?:UN)?RAR (\d+\.\d+)", output)
@@ -74,19 +91,30 @@ class Unrar(ArchivePack):
             0,
         ), f"{cls._command[0]}: incompatible version {cls.version}"
 
-    def __init__(self, name, fileobj):
+    def __init__(self, name, fileobj, listing_cache=None):
+        key = listing_cache and listing_cache.file_key(fileobj)
         self.fileobj = ArchiveTemp(fileobj)
-        output = check_output(
-            self._command + ["vta", self.fileobj.name]
-        ).decode()
-        hunks = iter_on_hunks(output.split("\n\n"))
-        self.information = next(hunks)
-        self.header = Header(next(hunks))
-        self._members = [m for m in (Member(h) for h in hunks)]
-        self._stream = len(self._members) == 1
+        listing = None
+        if listing_cache is not None:
+            key = key or listing_cache.content_key(self.fileobj)
+            listing = listing_cache.get(type(self)._compression, key)
+        if listing is not None:
+            self.information = listing["information"]
+            self.header = _restore(Header, listing["header"])
+            self._listing = _LazyList(
+                _restore(Member, x) for x in listing["members"]
+            )
+        else:
+            on_complete = None
+            if listing_cache is not None:
+                on_complete = partial(self._store, listing_cache, key)
+            self._listing = _LazyList(self._list(), on_complete=on_complete)
+        # NOTE: the listing is parsed while it is needed, only the first two
+        #       members are needed to know if the archive holds a single file
+        self._stream = len(self._listing.fill(2)) == 1
         if self._stream:
-            stream = self.open(self._members[0])
-            stream_name = self._members[0].filename
+            stream = self.open(self._listing.items[0])
+            stream_name = self._listing.items[0].filename
             self._compression += ":" + stream_name
         else:
             stream_name = name
@@ -94,8 +122,42 @@ class Unrar(ArchivePack):
             stream.seek(0)
         ArchivePack.__init__(self, stream_name, stream, source=fileobj)
 
+    def _list(self):
+        """
+        Parse the header and iterate over the members while the listing is
+        read
+        """
+        hunks = iter_on_hunks(
+            _iter_hunks(
+                _iter_command_lines(self._command + ["vta", self.fileobj.name])
+            )
+        )
+        self.information = next(hunks)
+        self.header = Header(next(hunks))
+        return (Member(h) for h in hunks)
+
+    def _store(self, listing_cache, key, members):
+        listing_cache.set(
+            type(self)._compression,
+            key,
+            {
+                "information": self.information,
+                "header": vars(self.header),
+                "members": [vars(x) for x in members],
+            },
+        )
+
     def members(self):
-        return self._members
+        return self._listing.fill()
+
+    def iter_members(self):
+        if self._stream:
+            return super().iter_members()
+        # NOTE: the members are extracted in a single pass, solid blocks are
+        #       not decompressed again for each member
+        return _iter_command_members(
+            self._command + ["p", "-inul", self.fileobj.name], self._listing
+        )
 
     def open(self, member):
         p = Popen(
@@ -114,7 +176,9 @@ class Unrar(ArchivePack):
             return p.stdout
         else:
             try:
-                temp = ArchiveTemp(p.stdout)
+                temp = ArchiveTemp(
+                    p.stdout, size=getattr(member, "size", None)
+                )
                 retcode = p.wait()
                 if retcode:
                     raise CalledProcessError(
@@ -140,6 +204,7 @@ class Unrar(ArchivePack):
                 self._p.wait()
         else:
             self.fileobj.close()
+        self._listing.close()
 
     def extract(self, member, path):
         p = Popen(
@@ -161,12 +226,16 @@ class Unrar(ArchivePack):
         finally:
             p.stdout.close()
 
-    def extractall(self, path, members=None):
+    def extractall(self, path, members=None, workers=None):
         if members is None:
             members = []
+        # NOTE: the command uses its own threads
+        options = [f"-mt{workers}"] if isinstance(workers, int) else []
         p = Popen(
             self._command
-            + ["x", self.fileobj.name]
+            + ["x"]
+            + options
+            + [self.fileobj.name]
             + [(m.filename if isinstance(m, Member) else m) for m in members]
             + [path],
             stdout=PIPE,
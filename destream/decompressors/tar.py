@@ -1,8 +1,17 @@
 import tarfile as tarlib
 import io
+import os
+import tempfile
+import threading
 from os import SEEK_SET
 
 from destream import ArchivePack, make_seekable
+from destream.helpers import (
+    SPOOL_SIZE,
+    _ChainReader,
+    _PositionalReader,
+    _for_each,
+)
 
 __all__ = ["Untar"]
 
@@ -56,13 +65,69 @@ class FileMember(io.IOBase, tarlib.ExFileObject):
         return len(buf)
 
 
+class _RecordingReader(io.RawIOBase):
+    """
+    Raw stream that keeps a copy of what is read from a file-object
+    """
+
+    def __init__(self, fileobj, recording):
+        super().__init__()
+        self.fileobj = fileobj
+        self.recording = recording
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = getattr(self.fileobj, "read1", self.fileobj.read)(len(b))
+        self.recording.write(data)
+        b[: len(data)] = data
+        return len(data)
+
+
+class _TarView:
+    """
+    What tarlib.ExFileObject uses of a tarfile: its file-object
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+
 class Untar(ArchivePack):
+    """
+    Make an archive from a tar file
+
+    In streaming mode (by default when the file-object is not seekable), the
+    archive is read forward only like the "r|" mode of tarfile: no temporary
+    file is made of the whole archive but the members can only be read once,
+    in order, using iter_members() or extracted using extractall(). To know
+    if the tar holds a single file, what is read until the second header is
+    kept (in memory if small enough).
+
+    The members opened from a seekable archive read it at their own
+    position (with os.pread for files), they can be read from multiple
+    threads at the same time.
+
+    With workers, extractall() writes the regular files of a seekable
+    archive in parallel: the directories are made first, in order, and the
+    owners, modes and times are set at the end.
+    """
+
     _mimes = ["application/x-tar"]
     _extensions = ["tar"]
     __compression = "tar"
     _compression = "tar"
+    _options = ["streaming"]
 
-    def __init__(self, name, fileobj):
+    def __init__(self, name, fileobj, streaming=None):
+        if streaming is None:
+            streaming = not fileobj.seekable()
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        if streaming:
+            self._init_streaming(name, fileobj)
+            return
         source = make_seekable(fileobj)
         self.tarfile = tarlib.TarFile.open(fileobj=source)
         first_member = self.tarfile.next()
@@ -79,27 +144,174 @@ class Untar(ArchivePack):
             stream.seek(0)
         ArchivePack.__init__(self, stream_name, source=source, fileobj=stream)
 
+    def _init_streaming(self, name, fileobj):
+        recording = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        tarfile = tarlib.TarFile.open(
+            fileobj=_RecordingReader(fileobj, recording), mode="r|"
+        )
+        first_member = tarfile.next()
+        if first_member is None:
+            raise OSError("can not read first member of the tar archive")
+        self._single = tarfile.next() is None
+        recording.seek(0)
+        if self._single:
+            # NOTE: the whole archive has been read
+            self.tarfile = tarlib.TarFile.open(fileobj=recording)
+            stream = tarlib.ExFileObject(self.tarfile, self.tarfile.next())
+            stream_name = first_member.name
+            self._compression += ":" + stream_name
+        else:
+            # NOTE: the archive is read again from its beginning
+            self.tarfile = None
+            stream_name = name
+            stream = io.BufferedReader(_ChainReader(recording, fileobj))
+        self._iterator = self._iter_streaming()
+        ArchivePack.__init__(self, stream_name, source=fileobj, fileobj=stream)
+
+    def _iter_streaming(self):
+        self.tarfile = tarlib.TarFile.open(fileobj=self, mode="r|")
+        for member in self.tarfile:
+            yield member, tarlib.ExFileObject(self.tarfile, member)
+
+    def _is_stream(self):
+        return self.streaming and not self._single
+
     def single(self):
         return self._single
 
     def members(self):
+        if self.streaming:
+            if not self._single:
+                for _ in self._iterator:
+                    pass
+            return self.tarfile.getmembers()
         pos = self.source.tell()
         members = self.tarfile.getmembers()
         self.source.seek(pos)
         return members
 
+    def iter_members(self):
+        if self._is_stream():
+            return self._iterator
+        return super().iter_members()
+
     def open(self, member):
-        return tarlib.ExFileObject(self.tarfile, member)
+        if self._is_stream():
+            raise io.UnsupportedOperation(
+                "the members of a stream can only be read using "
+                "iter_members()"
+            )
+        if self.streaming:
+            return tarlib.ExFileObject(self.tarfile, member)
+        reader = _PositionalReader(self.tarfile.fileobj, self._lock)
+        return tarlib.ExFileObject(_TarView(io.BufferedReader(reader)), member)
 
     def extract(self, member, path):
+        if self._is_stream():
+            raise io.UnsupportedOperation(
+                "the members of a stream can only be extracted using "
+                "extractall()"
+            )
         return self.tarfile.extract(member, path)
 
-    def extractall(self, path, members=None):
-        return self.tarfile.extractall(path, members)
+    def extractall(self, path, members=None, workers=None):
+        if not self._is_stream():
+            if workers and not self._single:
+                return self._extractall_parallel(path, members, workers)
+            return self.tarfile.extractall(path, members)
+        # NOTE: the members of a stream arrive one after the other, they are
+        #       extracted sequentially
+        if members is not None:
+            members = {getattr(x, "name", x) for x in members}
+        for member, _ in self.iter_members():
+            if members is None or member.name in members:
+                self.tarfile.extract(member, path)
+
+    @staticmethod
+    def _extract_in_any_order(members):
+        """
+        Return True if the members can be extracted in any order: only
+        directories and regular files with distinct relative names, none
+        going out of the destination and no file holding another member
+        """
+        names = set()
+        files = set()
+        for member in members:
+            if not member.isdir() and (
+                not member.isreg() or member.issparse()
+            ):
+                return False
+            name = os.path.normpath(member.name)
+            if (
+                os.path.isabs(name)
+                or os.pardir in name.split(os.sep)
+                or name in names
+            ):
+                return False
+            names.add(name)
+            if not member.isdir():
+                files.add(name)
+        for name in names:
+            parent = os.path.dirname(name)
+            while parent:
+                if parent in files:
+                    return False
+                parent = os.path.dirname(parent)
+        return True
+
+    def _extractall_parallel(self, path, members, workers):
+        if members is None:
+            members = self.members()
+        else:
+            members = [
+                (
+                    x
+                    if isinstance(x, tarlib.TarInfo)
+                    else self.tarfile.getmember(x)
+                )
+                for x in members
+            ]
+        if not self._extract_in_any_order(members):
+            # NOTE: links and repeated names depend on the order of the
+            #       archive
+            return self.tarfile.extractall(path, members)
+        local = threading.local()
+        start = self.members()[0].offset
+
+        def extract_file(member):
+            # NOTE: each worker reads the archive with its own tarfile at its
+            #       own position
+            if not hasattr(local, "tarfile"):
+                reader = _PositionalReader(self.source, self._lock)
+                reader.seek(start)
+                local.tarfile = tarlib.TarFile(
+                    fileobj=io.BufferedReader(reader)
+                )
+                if hasattr(self.tarfile, "extraction_filter"):
+                    local.tarfile.extraction_filter = (
+                        self.tarfile.extraction_filter
+                    )
+            local.tarfile.extract(member, path)
+
+        directories = [x for x in members if x.isdir()]
+        files = [x for x in members if not x.isdir()]
+        for member in directories:
+            os.makedirs(os.path.join(path, member.name), exist_ok=True)
+        for member in files:
+            target = os.path.dirname(os.path.join(path, member.name))
+            os.makedirs(target or path, exist_ok=True)
+        _for_each(extract_file, files, workers)
+        # NOTE: like tarfile, the attributes of the directories are set last
+        #       (the modification time changes when their content changes)
+        self.tarfile.extractall(path, directories)
 
     def close(self):
-        return super().close() if self.single() else self.tarfile.close()
+        if self.single() or self.streaming:
+            return super().close()
+        return self.tarfile.close()
 
     @property
     def closed(self):
-        return super().closed if self.single() else self.tarfile.closed
+        if self.single() or self.streaming:
+            return super().closed
+        return self.tarfile.closed
@@ -1,10 +1,163 @@
+import io
+import struct
+import zlib
+
+try:
+    import lzma
+except ImportError:  # pragma: no cover
+    lzma = None
+
 from destream import ExternalPipe
+from destream.helpers import read_exactly
 
 __all__ = ["Unxz"]
 
 
+HEADER_MAGIC = b"\xfd7zXZ\x00"
+FOOTER_MAGIC = b"YZ"
+
+
+def _round4(size):
+    return size + -size % 4
+
+
+def encode_multibyte(value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def decode_multibyte(data, pos):
+    value = 0
+    for i in range(9):
+        byte = data[pos + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, pos + i + 1
+    raise ValueError("xz: invalid multibyte integer")
+
+
+def parse_index(index):
+    """
+    Return the list of records (unpadded size, uncompressed size) of an xz
+    index
+    """
+    if (
+        index[0] != 0
+        or zlib.crc32(index[:-4]) != struct.unpack("<I", index[-4:])[0]
+    ):
+        raise ValueError("xz: invalid index")
+    count, pos = decode_multibyte(index, 1)
+    records = []
+    for _ in range(count):
+        unpadded, pos = decode_multibyte(index, pos)
+        uncompressed, pos = decode_multibyte(index, pos)
+        records.append((unpadded, uncompressed))
+    return records
+
+
+def read_blocks(fileobj, start=0):
+    """
+    Read the indexes of the streams of a seekable file-object from its end
+    and return the list of the blocks: (stream flags, offset, unpadded size,
+    uncompressed size)
+    """
+    streams = []
+    end = fileobj.seek(0, io.SEEK_END)
+    while end > start:
+        fileobj.seek(end - 4)
+        # NOTE: stream padding
+        if read_exactly(fileobj, 4) == b"\0\0\0\0":
+            end -= 4
+            continue
+        fileobj.seek(end - 12)
+        footer = read_exactly(fileobj, 12)
+        if footer[10:] != FOOTER_MAGIC:
+            raise ValueError("xz: invalid stream footer")
+        (backward_size,) = struct.unpack("<I", footer[4:8])
+        index_size = (backward_size + 1) * 4
+        index_start = end - 12 - index_size
+        fileobj.seek(index_start)
+        records = parse_index(read_exactly(fileobj, index_size))
+        stream_start = index_start - sum(_round4(x) for x, _ in records) - 12
+        fileobj.seek(stream_start)
+        header = read_exactly(fileobj, 12)
+        if header[:6] != HEADER_MAGIC or header[6:8] != footer[8:10]:
+            raise ValueError("xz: invalid stream header")
+        offset = stream_start + 12
+        blocks = []
+        for unpadded, uncompressed in records:
+            blocks.append((header[6:8], offset, unpadded, uncompressed))
+            offset += _round4(unpadded)
+        streams.insert(0, blocks)
+        end = stream_start
+    return [block for blocks in streams for block in blocks]
+
+
+def make_stream(flags, block, unpadded, uncompressed):
+    """
+    Make a standalone xz stream of a single block
+    """
+    header = HEADER_MAGIC + flags + struct.pack("<I", zlib.crc32(flags))
+    index = b"\0\x01" + encode_multibyte(unpadded)
+    index += encode_multibyte(uncompressed)
+    index += b"\0" * (-len(index) % 4)
+    index += struct.pack("<I", zlib.crc32(index))
+    backward = struct.pack("<I", len(index) // 4 - 1) + flags
+    footer = struct.pack("<I", zlib.crc32(backward)) + backward + FOOTER_MAGIC
+    return header + block + index + footer
+
+
+def decompress_stream(data):
+    return lzma.decompress(data, lzma.FORMAT_XZ)
+
+
+def iter_streams(fileobj, blocks):
+    for flags, offset, unpadded, uncompressed in blocks:
+        fileobj.seek(offset)
+        block = read_exactly(fileobj, _round4(unpadded))
+        yield make_stream(flags, block, unpadded, uncompressed)
+
+
 class Unxz(ExternalPipe):
+    """
+    Decompress xz
+
+    With workers, the blocks of seekable files are located using the index of
+    the streams and decompressed in parallel (files compressed with xz -T0
+    for example). Non-seekable files and files made of a single block are
+    decompressed sequentially.
+    """
+
     _mimes = ["application/x-xz"]
     _extensions = ["xz"]
     _command = "unxz -c".split()
     _compression = "xz"
+    _magic = HEADER_MAGIC
+    # NOTE: stream padding, multiples of 4 null bytes between the streams
+    _padding = 4
+    _options = ExternalPipe._options + ["workers", "max_memory"]
+
+    if lzma is not None:
+        _decompress_chunk = staticmethod(decompress_stream)
+
+        @staticmethod
+        def _decompressobj():
+            return lzma.LZMADecompressor(lzma.FORMAT_XZ)
+
+    def _iter_chunks(self, stdin):
+        if not stdin.seekable():
+            return None
+        start = stdin.tell()
+        try:
+            blocks = read_blocks(stdin, start)
+        except (ValueError, EOFError, IndexError, OSError):
+            # NOTE: let the sequential decompressor report the error
+            blocks = []
+        stdin.seek(start)
+        if len(blocks) < 2:
+            return None
+        return iter_streams(stdin, blocks)
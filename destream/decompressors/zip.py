@@ -1,16 +1,390 @@
+import bz2
+import io
+import os
+import struct
+import tempfile
+import threading
 import zipfile
+import zlib
+from shutil import copyfileobj
 
 from destream import ArchivePack, make_seekable
+from destream.helpers import (
+    CHUNK_SIZE,
+    SPOOL_SIZE,
+    ZlibDecompressor,
+    _ChainReader,
+    _PositionalReader,
+    _for_each,
+    spool,
+)
 
 __all__ = ["Unzip"]
 
 
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+FLAG_ENCRYPTED = 0x01
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+ZIP64_EXTRA = 0x0001
+STREAMABLE_METHODS = (
+    zipfile.ZIP_STORED,
+    zipfile.ZIP_DEFLATED,
+    zipfile.ZIP_BZIP2,
+)
+
+
+class _NotStreamable(Exception):
+    """
+    The next member of a _ZipStream is encrypted or uses a compression
+    method that can not be streamed, its local header has been put back
+    """
+
+
+class _ZipFileView(zipfile.ZipFile):
+    """
+    Read the members of a zipfile through another file-object, the central
+    directory parsed by the zipfile is shared instead of being read again
+    """
+
+    def __init__(self, parsed, fileobj):
+        self._parsed = parsed
+        super().__init__(fileobj)
+
+    def _RealGetContents(self):
+        # NOTE: called by the constructor of ZipFile to parse the directory
+        self.filelist = self._parsed.filelist
+        self.NameToInfo = self._parsed.NameToInfo
+        self.start_dir = self._parsed.start_dir
+        self._comment = self._parsed.comment
+
+
+class _ZipStream:
+    """
+    Read the members of a zip file-object in order using the local file
+    headers, the central directory is never read
+
+    What is read from the file-object can be recorded to replay it.
+    """
+
+    def __init__(self, fileobj, record=False):
+        self.fileobj = fileobj
+        self._read = getattr(fileobj, "read1", fileobj.read)
+        self._buffer = b""
+        self.recording = (
+            tempfile.SpooledTemporaryFile(SPOOL_SIZE) if record else None
+        )
+        self.current = None
+
+    def read(self, size):
+        """
+        Read at most size bytes, less only at the end of the file-object
+        """
+        data = b""
+        while len(data) < size:
+            if not self._buffer:
+                self._buffer = self._read(max(size - len(data), CHUNK_SIZE))
+                if not self._buffer:
+                    break
+                if self.recording is not None:
+                    self.recording.write(self._buffer)
+            chunk = self._buffer[: size - len(data)]
+            self._buffer = self._buffer[len(chunk) :]
+            data += chunk
+        return data
+
+    def read_exactly(self, size):
+        data = self.read(size)
+        if len(data) < size:
+            raise EOFError(
+                f"unexpected end of file: {len(data)} bytes read on {size}"
+            )
+        return data
+
+    def unread(self, data):
+        self._buffer = data + self._buffer
+
+    def rest(self):
+        """
+        Return a file-object reading what has not been read yet
+        """
+        buffer, self._buffer = self._buffer, b""
+        return io.BufferedReader(
+            _ChainReader(io.BytesIO(buffer), self.fileobj)
+        )
+
+    def stop_recording(self):
+        recording, self.recording = self.recording, None
+        recording.seek(0)
+        return recording
+
+    def next(self):
+        """
+        Skip the rest of the current member and return the next one (ZipInfo,
+        stream) or None if there is no more member
+        """
+        if self.current is not None:
+            self.current.skip()
+            self.current = None
+        signature = self.read(4)
+        if signature != LOCAL_HEADER_SIGNATURE:
+            self.unread(signature)
+            return None
+        (
+            _,
+            version,
+            flags,
+            method,
+            mtime,
+            mdate,
+            crc,
+            compress_size,
+            file_size,
+            name_size,
+            extra_size,
+        ) = LOCAL_HEADER.unpack(signature + self.read_exactly(26))
+        header = self.read_exactly(name_size + extra_size)
+        if flags & FLAG_ENCRYPTED or method not in STREAMABLE_METHODS:
+            self.unread(
+                LOCAL_HEADER.pack(
+                    signature,
+                    version,
+                    flags,
+                    method,
+                    mtime,
+                    mdate,
+                    crc,
+                    compress_size,
+                    file_size,
+                    name_size,
+                    extra_size,
+                )
+                + header
+            )
+            raise _NotStreamable()
+        filename = header[:name_size].decode(
+            "utf-8" if flags & FLAG_UTF8 else "cp437"
+        )
+        extra = header[name_size:]
+        info = zipfile.ZipInfo(
+            filename,
+            (
+                (mdate >> 9) + 1980,
+                mdate >> 5 & 0xF,
+                mdate & 0x1F,
+                mtime >> 11,
+                mtime >> 5 & 0x3F,
+                (mtime & 0x1F) * 2,
+            ),
+        )
+        info.extract_version = version
+        info.flag_bits = flags
+        info.compress_type = method
+        info.CRC = crc
+        info.compress_size = compress_size
+        info.file_size = file_size
+        info.extra = extra
+        zip64 = False
+        pos = 0
+        while pos + 4 <= len(extra):
+            tag, size = struct.unpack("<HH", extra[pos : pos + 4])
+            if tag == ZIP64_EXTRA:
+                zip64 = True
+                values = extra[pos + 4 : pos + 4 + size]
+                if file_size == 0xFFFFFFFF:
+                    (info.file_size,) = struct.unpack("<Q", values[:8])
+                    values = values[8:]
+                if compress_size == 0xFFFFFFFF:
+                    (info.compress_size,) = struct.unpack("<Q", values[:8])
+            pos += 4 + size
+        self.current = _ZipMemberReader(self, info, zip64)
+        return info, io.BufferedReader(self.current)
+
+
+class _ZipMemberReader(io.RawIOBase):
+    """
+    Raw stream decompressing a member of a _ZipStream
+    """
+
+    def __init__(self, stream, info, zip64):
+        super().__init__()
+        self.stream = stream
+        self.info = info
+        self.zip64 = zip64
+        self.descriptor = info.flag_bits & FLAG_DATA_DESCRIPTOR
+        if info.compress_type == zipfile.ZIP_STORED:
+            self.decompressor = None
+        elif info.compress_type == zipfile.ZIP_DEFLATED:
+            self.decompressor = ZlibDecompressor(-zlib.MAX_WBITS)
+        else:
+            self.decompressor = bz2.BZ2Decompressor()
+        # NOTE: the compressed size is not known before the data descriptor
+        self.remaining = None if self.descriptor else info.compress_size
+        self.crc = 0
+        self.size = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def _finish(self):
+        if self.descriptor:
+            data = self.stream.read_exactly(4)
+            if data == DATA_DESCRIPTOR_SIGNATURE:
+                data = self.stream.read_exactly(4)
+            (self.info.CRC,) = struct.unpack("<I", data)
+            if self.zip64:
+                sizes = struct.unpack("<QQ", self.stream.read_exactly(16))
+            else:
+                sizes = struct.unpack("<II", self.stream.read_exactly(8))
+            self.info.compress_size, self.info.file_size = sizes
+        if self.crc != self.info.CRC or self.size != self.info.file_size:
+            raise zipfile.BadZipFile(f"{self.info.filename}: bad CRC-32")
+        self.eof = True
+
+    def _read_compressed(self, size):
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+            if size == 0:
+                return b""
+        data = self.stream.read(size)
+        if not data:
+            raise EOFError(f"{self.info.filename}: unexpected end of file")
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return data
+
+    def _read_stored(self, size):
+        # NOTE: the size of a stored member followed by a data descriptor is
+        #       unknown, the data ends at the first data descriptor signature
+        #       followed by the right CRC and sizes
+        descriptor_size = 24 if self.zip64 else 16
+        data = b""
+        pos = 0
+        while True:
+            pos = data.find(DATA_DESCRIPTOR_SIGNATURE, pos)
+            if pos == -1:
+                # NOTE: keep what could be the beginning of a signature
+                keep = len(DATA_DESCRIPTOR_SIGNATURE) - 1
+                if len(data) > keep:
+                    self.stream.unread(data[-keep:])
+                    return data[:-keep]
+            elif len(data) >= pos + descriptor_size:
+                crc, compress_size, file_size = struct.unpack(
+                    "<IQQ" if self.zip64 else "<III",
+                    data[pos + 4 : pos + descriptor_size],
+                )
+                if (
+                    compress_size == file_size == self.size + pos
+                    and zlib.crc32(data[:pos], self.crc) == crc
+                ):
+                    self.stream.unread(data[pos:])
+                    self.remaining = 0
+                    return data[:pos]
+                pos += 1
+                continue
+            chunk = self.stream.read(max(size, descriptor_size))
+            if not chunk:
+                raise EOFError(f"{self.info.filename}: unexpected end of file")
+            data += chunk
+            pos = max(pos if pos != -1 else len(data) - len(chunk) - 3, 0)
+
+    def readinto(self, b):
+        if self.eof or len(b) == 0:
+            return 0
+        if self.decompressor is None and self.descriptor:
+            data = self._read_stored(len(b))
+            if len(data) > len(b):
+                self.stream.unread(data[len(b) :])
+                data = data[: len(b)]
+                self.remaining = None
+        elif self.decompressor is None:
+            data = self._read_compressed(len(b))
+        else:
+            data = b""
+            while not data and not self.decompressor.eof:
+                compressed = b""
+                if self.decompressor.needs_input:
+                    compressed = self._read_compressed(CHUNK_SIZE)
+                    if not compressed:
+                        # NOTE: the compressed size of the header is too small
+                        raise zipfile.BadZipFile(
+                            f"{self.info.filename}: truncated compressed data"
+                        )
+                data = self.decompressor.decompress(compressed, len(b))
+            if self.decompressor.eof:
+                self.stream.unread(self.decompressor.unused_data)
+                if self.remaining is not None:
+                    self.remaining += len(self.decompressor.unused_data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        if (
+            self.decompressor.eof
+            if self.decompressor is not None
+            else self.remaining == 0
+        ):
+            self._finish()
+        b[: len(data)] = data
+        return len(data)
+
+    def skip(self):
+        while self.read(CHUNK_SIZE):
+            pass
+
+
+def _extract_path(filename, path):
+    # NOTE: same sanitization than zipfile
+    arcname = filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(
+        x for x in arcname.split(os.path.sep) if x not in invalid
+    )
+    return os.path.join(path, arcname)
+
+
 class Unzip(ArchivePack):
+    """
+    Make an archive from a zip file
+
+    In streaming mode (by default when the file-object is not seekable), the
+    members are read in order using their local file header: no temporary
+    file is used but the members can only be read once using iter_members()
+    or extracted using extractall(). The first member is kept (in memory if
+    small enough) to know if the zip holds a single file. From the first
+    member that can not be streamed (encrypted or compressed with another
+    method than deflate or bzip2), the rest of the stream is written to a
+    temporary file and read with zipfile.
+
+    The members opened from a seekable archive read it at their own
+    position (with os.pread for files), they can be read from multiple
+    threads at the same time.
+
+    With workers, extractall() decompresses the members of a seekable
+    archive in parallel, the directories are made first.
+    """
+
     _mimes = ["application/zip"]
     _extensions = ["zip"]
     _compression = "zip"
+    _options = ["streaming"]
 
-    def __init__(self, name, fileobj):
+    def __init__(self, name, fileobj, streaming=None):
+        if streaming is None:
+            streaming = not fileobj.seekable()
+        self.streaming = streaming
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if streaming:
+            self._init_streaming(name, fileobj)
+            return
+        self._init_zipfile(name, fileobj)
+
+    def _init_zipfile(self, name, fileobj):
         # part of the Zip header is at the end of the file. Therefore, we have
         # to create a temporary file from the previous stream and write the
         # whole content
@@ -25,14 +399,190 @@ class Unzip(ArchivePack):
             fileobj=(self.single() and self.open(self.members()[0])),
         )
 
+    def _init_streaming(self, name, fileobj):
+        self._zipstream = _ZipStream(fileobj, record=True)
+        self._members = []
+        try:
+            first = self._zipstream.next()
+            if first is not None:
+                info, stream = first
+                self._members.append(info)
+                self._first = info, spool(stream, size=info.file_size)
+                second = self._zipstream.next()
+                if second is not None:
+                    self._members.append(second[0])
+            else:
+                self._first = second = None
+        except _NotStreamable:
+            # NOTE: what has been read is still recorded, the whole archive
+            #       is read with zipfile like a seekable one
+            self.streaming = False
+            self._init_zipfile(
+                name,
+                io.BufferedReader(
+                    _ChainReader(self._zipstream.stop_recording(), fileobj)
+                ),
+            )
+            return
+        self._single = first is not None and second is None
+        self._iterator = self._iter_streaming(second)
+        if self._single:
+            self._compression += ":" + self._first[0].filename
+            stream = self._first[1]
+        else:
+            # NOTE: the archive can still be read from the beginning
+            stream = io.BufferedReader(
+                _ChainReader(self._zipstream.stop_recording(), fileobj)
+            )
+        self._zipstream.recording = None
+        ArchivePack.__init__(self, name, source=fileobj, fileobj=stream)
+
+    def _iter_streaming(self, current):
+        if self._first is None:
+            return
+        yield self._first
+        while current is not None:
+            yield current
+            try:
+                current = self._zipstream.next()
+            except _NotStreamable:
+                yield from self._iter_spooled()
+                return
+            if current is not None:
+                self._members.append(current[0])
+
+    def _iter_spooled(self):
+        # NOTE: the rest of the stream starts at the local header of the
+        #       current member, zipfile finds the members from the central
+        #       directory: the offsets of those already read are negative
+        rest = zipfile.ZipFile(spool(self._zipstream.rest()))
+        members = sorted(
+            (x for x in rest.infolist() if x.header_offset >= 0),
+            key=lambda x: x.header_offset,
+        )
+        for info in members:
+            self._members.append(info)
+            yield info, rest.open(info)
+
+    def single(self):
+        if self.streaming:
+            return self._single
+        return super().single()
+
     def members(self):
+        if self.streaming:
+            for _ in self._iterator:
+                pass
+            return self._members
         return self.zipfile.infolist()
 
+    def iter_members(self):
+        if self.streaming:
+            return self._iterator
+        return super().iter_members()
+
     def open(self, member):
-        return self.zipfile.open(member)
+        if self.streaming:
+            if self._first is not None and member is self._first[0]:
+                return self._first[1]
+            raise io.UnsupportedOperation(
+                "the members of a stream can only be read using "
+                "iter_members()"
+            )
+        if not isinstance(member, zipfile.ZipInfo):
+            member = self.zipfile.getinfo(member)
+        if member.flag_bits & FLAG_ENCRYPTED:
+            return self.zipfile.open(member)
+        # NOTE: the member is read at its own position with a zipfile of the
+        #       thread (the file-object of a zipfile is shared by its members)
+        return self._thread_zipfile().open(member)
+
+    def _thread_zipfile(self):
+        if not hasattr(self._local, "zipfile"):
+            reader = _PositionalReader(self.zipfile.fp, self._lock)
+            self._local.zipfile = _ZipFileView(
+                self.zipfile, io.BufferedReader(reader)
+            )
+        return self._local.zipfile
 
     def extract(self, member, path):
+        if self.streaming:
+            raise io.UnsupportedOperation(
+                "the members of a stream can only be extracted using "
+                "extractall()"
+            )
         return self.zipfile.extract(member, path)
 
-    def extractall(self, path, members=None):
-        return self.zipfile.extractall(path, members)
+    def extractall(self, path, members=None, workers=None):
+        if not self.streaming:
+            if workers:
+                return self._extractall_parallel(path, members, workers)
+            return self.zipfile.extractall(path, members)
+        # NOTE: the members of a stream arrive one after the other, they are
+        #       extracted sequentially
+        if members is not None:
+            members = {getattr(x, "filename", x) for x in members}
+        for info, stream in self.iter_members():
+            if members is not None and info.filename not in members:
+                continue
+            target = _extract_path(info.filename, path)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(target) or path, exist_ok=True)
+            with open(target, "wb") as fh:
+                copyfileobj(stream, fh)
+
+    @staticmethod
+    def _extract_in_any_order(members):
+        """
+        Return True if the members can be extracted in any order: distinct
+        targets and no file holding another member
+        """
+        names = set()
+        files = set()
+        for info in members:
+            name = _extract_path(info.filename, "")
+            if name in names:
+                return False
+            names.add(name)
+            if not info.is_dir():
+                files.add(name)
+        for name in names:
+            parent = os.path.dirname(name)
+            while parent:
+                if parent in files:
+                    return False
+                parent = os.path.dirname(parent)
+        return True
+
+    def _extractall_parallel(self, path, members, workers):
+        if members is None:
+            members = self.zipfile.infolist()
+        else:
+            members = [
+                (
+                    x
+                    if isinstance(x, zipfile.ZipInfo)
+                    else self.zipfile.getinfo(x)
+                )
+                for x in members
+            ]
+        if not self._extract_in_any_order(members):
+            # NOTE: the last of the members with the same target wins
+            return self.zipfile.extractall(path, members)
+
+        def extract_file(info):
+            # NOTE: each worker reads the archive with its own zipfile at its
+            #       own position
+            self._thread_zipfile().extract(info, path)
+
+        files = []
+        for info in members:
+            target = _extract_path(info.filename, path)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+            else:
+                files.append(info)
+                os.makedirs(os.path.dirname(target) or path, exist_ok=True)
+        _for_each(extract_file, files, workers)
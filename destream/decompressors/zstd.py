@@ -1,10 +1,378 @@
+import bisect
+import errno
+import io
+import os
+import struct
+from concurrent.futures import Executor, ThreadPoolExecutor
+
+try:
+    # NOTE: available in the standard library since Python 3.14
+    from compression import zstd
+except ImportError:
+    zstd = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from destream import ExternalPipe
+from destream.helpers import DEFAULT_MAX_MEMORY, read_exactly
 
 __all__ = ["Unzstd"]
 
 
+FRAME_MAGIC = b"\x28\xb5\x2f\xfd"
+SKIPPABLE_MAGICS = tuple(struct.pack("<I", 0x184D2A50 + i) for i in range(16))
+SEEK_TABLE_MAGIC = struct.pack("<I", 0x184D2A5E)
+SEEKABLE_MAGIC = struct.pack("<I", 0x8F92EAB1)
+SEEK_TABLE_FOOTER_SIZE = 9
+
+
+class ZstandardDecompressor:
+    """
+    Wrap a decompression object of the zstandard module to provide the same
+    interface than the decompressors of the bz2 and lzma modules
+
+    The decompression object of zstandard has no max_length: the input is
+    given to it by steps of INPUT_STEP bytes until enough output is
+    available, the output not returned yet is kept in a bytearray.
+    """
+
+    INPUT_STEP = 16 * 1024
+
+    def __init__(self):
+        self._decompressobj = zstandard.ZstdDecompressor().decompressobj()
+        self._input = b""
+        self._input_pos = 0
+        self._output = bytearray()
+        self._pos = 0
+
+    @property
+    def eof(self):
+        return self._decompressobj.eof and self._pos == len(self._output)
+
+    @property
+    def needs_input(self):
+        return (
+            self._input_pos == len(self._input)
+            and self._pos == len(self._output)
+            and not self._decompressobj.eof
+        )
+
+    @property
+    def unused_data(self):
+        return self._decompressobj.unused_data + self._input[self._input_pos :]
+
+    def decompress(self, data, max_length=-1):
+        if data:
+            self._input = self._input[self._input_pos :] + data
+            self._input_pos = 0
+        view = memoryview(self._input)
+        while (
+            self._input_pos < len(self._input) and not self._decompressobj.eof
+        ):
+            if 0 <= max_length <= len(self._output) - self._pos:
+                break
+            end = self._input_pos + self.INPUT_STEP
+            self._output += self._decompressobj.decompress(
+                view[self._input_pos : end]
+            )
+            self._input_pos = min(end, len(self._input))
+        end = len(self._output)
+        if max_length >= 0:
+            end = min(end, self._pos + max_length)
+        output = bytes(self._output[self._pos : end])
+        self._pos = end
+        if self._pos == len(self._output):
+            self._output.clear()
+            self._pos = 0
+        elif self._pos > len(self._output) // 2:
+            # NOTE: drop what has been returned without copying the output
+            #       on every call
+            del self._output[: self._pos]
+            self._pos = 0
+        return output
+
+
+class ZstandardReader(io.RawIOBase):
+    """
+    Raw stream decompressing a file-object with the stream reader of the
+    zstandard module, which gives at most the size requested for each read
+    (unlike its decompression object)
+    """
+
+    def __init__(self, fileobj):
+        super().__init__()
+        self._reader = zstandard.ZstdDecompressor().stream_reader(
+            fileobj, read_across_frames=True, closefd=False
+        )
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._reader.readinto(b)
+
+    def close(self):
+        if not self.closed:
+            self._reader.close()
+        super().close()
+
+
+def decompressobj():
+    if zstd is not None:
+        return zstd.ZstdDecompressor()
+    return ZstandardDecompressor()
+
+
+def decompress_frame(frame):
+    return decompressobj().decompress(frame)
+
+
+def iter_frames(fileobj):
+    """
+    Iterate over the zstd frames of a file-object without decompressing
+    them, skippable frames are ignored
+    """
+    while True:
+        magic = fileobj.read(4)
+        if not magic:
+            return
+        magic = magic + read_exactly(fileobj, 4 - len(magic))
+        if magic in SKIPPABLE_MAGICS:
+            (size,) = struct.unpack("<I", read_exactly(fileobj, 4))
+            read_exactly(fileobj, size)
+            continue
+        if magic != FRAME_MAGIC:
+            raise ValueError(f"invalid zstd frame magic: {magic!r}")
+        chunks = [magic]
+        descriptor = read_exactly(fileobj, 1)
+        chunks.append(descriptor)
+        fcs_flag = descriptor[0] >> 6
+        single_segment = descriptor[0] >> 5 & 1
+        checksum = descriptor[0] >> 2 & 1
+        did_flag = descriptor[0] & 3
+        header_size = (
+            (0 if single_segment else 1)
+            + (0, 1, 2, 4)[did_flag]
+            + (single_segment, 2, 4, 8)[fcs_flag]
+        )
+        chunks.append(read_exactly(fileobj, header_size))
+        last_block = False
+        while not last_block:
+            block_header = read_exactly(fileobj, 3)
+            chunks.append(block_header)
+            (value,) = struct.unpack("<I", block_header + b"\0")
+            last_block = value & 1
+            block_type = value >> 1 & 3
+            block_size = value >> 3
+            if block_type == 3:
+                raise ValueError("invalid zstd block type")
+            chunks.append(
+                read_exactly(fileobj, 1 if block_type == 1 else block_size)
+            )
+        if checksum:
+            chunks.append(read_exactly(fileobj, 4))
+        yield b"".join(chunks)
+
+
+def read_seek_table(fileobj, start=0):
+    """
+    Read the seek table of a seekable file-object in the zstd seekable
+    format and return the list of the frames: (offset, compressed size,
+    decompressed size), None if there is no valid seek table
+    """
+    end = fileobj.seek(0, io.SEEK_END)
+    if end - start < 8 + SEEK_TABLE_FOOTER_SIZE:
+        return None
+    fileobj.seek(end - SEEK_TABLE_FOOTER_SIZE)
+    footer = read_exactly(fileobj, SEEK_TABLE_FOOTER_SIZE)
+    if footer[5:] != SEEKABLE_MAGIC:
+        return None
+    count, descriptor = struct.unpack("<IB", footer[:5])
+    entry_size = 12 if descriptor & 0x80 else 8
+    table_size = count * entry_size + SEEK_TABLE_FOOTER_SIZE
+    table_start = end - table_size - 8
+    if table_start < start:
+        return None
+    fileobj.seek(table_start)
+    header = read_exactly(fileobj, 8)
+    if header != SEEK_TABLE_MAGIC + struct.pack("<I", table_size):
+        return None
+    table = read_exactly(fileobj, count * entry_size)
+    frames = []
+    offset = start
+    for i in range(0, len(table), entry_size):
+        compressed, decompressed = struct.unpack("<II", table[i : i + 8])
+        frames.append((offset, compressed, decompressed))
+        offset += compressed
+    if offset != table_start:
+        return None
+    return frames
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """
+    Raw stream decompressing a zstd file-object in the seekable format with
+    random access
+
+    A read decompresses only the frame containing the position, the last
+    decompressed frame is kept for the next reads. With workers, the frames
+    following the one being read are decompressed in advance on a pool of
+    workers (bounded like _ParallelReader) so that a full scan is done in
+    parallel.
+    """
+
+    def __init__(self, fileobj, frames, workers=None, max_memory=None):
+        super().__init__()
+        self.fileobj = fileobj
+        self._frames = frames
+        self._starts = []
+        self._size = 0
+        for _, _, decompressed in frames:
+            self._starts.append(self._size)
+            self._size += decompressed
+        self._pos = 0
+        self._frame = None
+        self._data = b""
+        self._executor = None
+        self._pending = {}
+        if workers:
+            if isinstance(workers, Executor):
+                self._executor = workers
+                self._shutdown = False
+                workers = os.cpu_count() or 1
+            else:
+                self._executor = ThreadPoolExecutor(workers)
+                self._shutdown = True
+            self._max_pending = 2 * workers
+            self._max_memory = max_memory or DEFAULT_MAX_MEMORY
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _read_frame(self, i):
+        offset, compressed, _ = self._frames[i]
+        self.fileobj.seek(offset)
+        return read_exactly(self.fileobj, compressed)
+
+    def _read_ahead(self, i):
+        # NOTE: after a seek, the frames out of the read-ahead window are
+        #       not needed anymore
+        for j in list(self._pending):
+            if not i < j <= i + self._max_pending:
+                self._pending.pop(j).cancel()
+        pending_size = sum(self._frames[j][1] for j in self._pending)
+        for j in range(
+            i + 1, min(i + 1 + self._max_pending, len(self._frames))
+        ):
+            if pending_size >= self._max_memory:
+                break
+            if j not in self._pending:
+                frame = self._read_frame(j)
+                self._pending[j] = self._executor.submit(
+                    decompress_frame, frame
+                )
+                pending_size += len(frame)
+
+    def _load(self, i):
+        future = self._pending.pop(i, None)
+        if future is not None:
+            data = future.result()
+        else:
+            data = decompress_frame(self._read_frame(i))
+        if len(data) != self._frames[i][2]:
+            raise OSError("zstd: the seek table does not match the frames")
+        if self._executor is not None:
+            self._read_ahead(i)
+        self._frame = i
+        self._data = data
+
+    def readinto(self, b):
+        if len(b) == 0 or self._pos >= self._size:
+            return 0
+        i = bisect.bisect_right(self._starts, self._pos) - 1
+        if i != self._frame:
+            self._load(i)
+        offset = self._pos - self._starts[i]
+        size = min(len(b), len(self._data) - offset)
+        b[:size] = self._data[offset : offset + size]
+        self._pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        if pos < 0:
+            raise OSError(errno.EINVAL, "negative seek position")
+        self._pos = pos
+        return pos
+
+    def close(self):
+        if not self.closed:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            if self._executor is not None and self._shutdown:
+                self._executor.shutdown(wait=True)
+        super().close()
+
+
 class Unzstd(ExternalPipe):
+    """
+    Decompress zstd, in-process if the zstd module (Python >= 3.14) or the
+    zstandard package is available
+
+    With workers, the frames are decompressed in parallel: this is only
+    useful for files made of multiple frames (concatenated files, pzstd or
+    the seekable format for example).
+
+    A seekable file in the seekable format (a seek table in a skippable frame
+    at the end) is decompressed in-process with random access, see
+    SeekableZstdReader.
+    """
+
     _mimes = ["application/zstd", "application/x-zstd"]
     _extensions = ["zst"]
     _command = "unzstd -c".split()
     _compression = "zstd"
+    _magic = (FRAME_MAGIC,) + SKIPPABLE_MAGICS
+    _options = ExternalPipe._options + ["workers", "max_memory"]
+
+    if zstd is not None or zstandard is not None:
+        _decompressobj = staticmethod(decompressobj)
+        _decompress_chunk = staticmethod(decompress_frame)
+
+    def _iter_chunks(self, stdin):
+        return iter_frames(stdin)
+
+    def _open_internal(self, stdin):
+        if stdin.seekable():
+            start = stdin.tell()
+            try:
+                frames = read_seek_table(stdin, start)
+            except (EOFError, OSError):
+                frames = None
+            stdin.seek(start)
+            if frames:
+                return SeekableZstdReader(
+                    stdin,
+                    frames,
+                    workers=self.workers,
+                    max_memory=self.max_memory,
+                )
+        if zstd is None and not self.workers:
+            return ZstandardReader(stdin)
+        return super()._open_internal(stdin)
@@ -1,15 +1,55 @@
-import magic
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import contextmanager
+from threading import Lock
 
-from destream import ArchiveFile, ArchivePack, builtin_decompressors
+try:
+    import magic
+except ImportError:
+    magic = None
+
+from destream.archive import RE_EXTENSION, _current_hooks, _emit, _local
+from destream import (
+    ArchiveFile,
+    ArchiveMmap,
+    ArchivePack,
+    ExternalPipe,
+    builtin_decompressors,
+    sniff_mime,
+)
 
 __all__ = """
-          Guesser open
+          Guesser open open_many
           """.split()
 
 
 class Guesser:
     """
     Make a stream using the decompressors given in the constructor
+
+    Extra keyword arguments are options given to the decompressors that
+    support them (listed in their _options attribute), for example:
+    engine="external" to use the external commands instead of the in-process
+    decompressors.
+
+    The decompressors are indexed by mime when they are set (use
+    add_decompressors() to add decompressors afterwards) and the decompressor
+    chosen for a mime, an extension and the decompressors already applied is
+    kept in a LRU cache of cache_size entries (0 to disable it).
+
+    With the option mmap=True, regular files are opened with ArchiveMmap.
+    With the option stats=True, the reads of the archives are counted, see
+    Archive.stats().
+
+    The hooks added with add_hook() are called with the events of the files
+    opened by the guesser, see destream.add_hook().
     """
 
     def __init__(
@@ -17,44 +57,370 @@ class Guesser:
         decompressors=builtin_decompressors,
         extra_decompressors=None,
         limit=10,
+        cache_size=256,
+        **options,
     ):
-        self.decompressors = decompressors
-        if extra_decompressors:
-            self.decompressors += extra_decompressors
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self._available = set()
+        self.decompressors = list(decompressors) + list(
+            extra_decompressors or []
+        )
         self.limit = limit
+        self.options = options
+        self.hooks = []
 
-    def guess(self, archive):
-        mime = magic.from_buffer(archive.peek(1024), mime=True)
-        for _, decompressor in sorted(self.decompressors, key=lambda x: x[0]):
-            if (
-                isinstance(archive, ArchivePack)
-                and type(archive) is decompressor
-            ):
-                continue
-            try:
-                realname = decompressor._guess(
-                    mime, str(archive.realname), archive
+    def __getstate__(self):
+        # NOTE: the guesser is sent to the workers of a process pool by map()
+        state = dict(self.__dict__)
+        del state["_lock"]
+        state["_cache"] = OrderedDict()
+        # NOTE: the events of the workers are not sent back to the hooks
+        state["hooks"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = Lock()
+
+    @property
+    def decompressors(self):
+        return self._decompressors
+
+    @decompressors.setter
+    def decompressors(self, decompressors):
+        self._decompressors = list(decompressors)
+        self._build_index()
+
+    def add_hook(self, hook):
+        """
+        Register a function called with the events of the files opened by
+        the guesser, see destream.add_hook()
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def add_decompressors(self, decompressors):
+        """
+        Add decompressors given as a list of tuples (priority, class)
+        """
+        self.decompressors = self._decompressors + list(decompressors)
+
+    def _build_index(self):
+        ordered = [
+            decompressor
+            for _, decompressor in sorted(
+                self._decompressors, key=lambda x: x[0]
+            )
+        ]
+        mimes = {m for x in ordered for m in getattr(x, "_mimes", [])}
+        # NOTE: decompressors without _mimes accept any mime
+        self._index = {
+            mime: [
+                x
+                for x in ordered
+                if not hasattr(x, "_mimes") or mime in x._mimes
+            ]
+            for mime in mimes
+        }
+        self._generic = [x for x in ordered if not hasattr(x, "_mimes")]
+        with self._lock:
+            self._cache.clear()
+
+    @staticmethod
+    def mime(data):
+        """
+        Identify the mime of the data using the signatures of the supported
+        formats, fallback to libmagic (if available) for the other formats
+        """
+        mime = sniff_mime(data)
+        if mime is not None:
+            return mime
+        if magic is not None:
+            return magic.from_buffer(data, mime=True)
+        return "application/octet-stream"
+
+    def _options_for(self, decompressor, options):
+        accepted = getattr(decompressor, "_options", ())
+        return {k: v for k, v in options.items() if k in accepted}
+
+    def _check_availability(self, decompressor, kwargs):
+        key = (decompressor, kwargs.get("engine"))
+        if key not in self._available:
+            decompressor._check_availability(**kwargs)
+            self._available.add(key)
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key not in self._cache:
+                return False, None
+            self._cache.move_to_end(key)
+            return True, self._cache[key]
+
+    def _cache_set(self, key, decompressor):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[key] = decompressor
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _try(self, decompressor, mime, archive, options, hooks=()):
+        if hooks:
+            _emit(
+                hooks,
+                "decompressor_tried",
+                archive=archive,
+                decompressor=decompressor,
+            )
+        if isinstance(archive, ArchivePack) and type(archive) is decompressor:
+            return self._reject(
+                hooks, archive, decompressor, "already applied"
+            )
+        try:
+            realname = decompressor._guess(
+                mime, str(archive.realname), archive
+            )
+        except ValueError as exc:
+            return self._reject(hooks, archive, decompressor, exc)
+        kwargs = self._options_for(decompressor, options)
+        start = time.perf_counter()
+        self._check_availability(decompressor, kwargs)
+        checked = time.perf_counter()
+        try:
+            guessed = decompressor(realname, archive, **kwargs)
+        except ValueError as exc:
+            return self._reject(hooks, archive, decompressor, exc)
+        guessed._timings = {
+            "check_availability": checked - start,
+            "init": time.perf_counter() - checked,
+        }
+        if hooks:
+            _emit(
+                hooks,
+                "layer_opened",
+                archive=guessed,
+                source=archive,
+                decompressor=decompressor,
+                seconds=time.perf_counter() - start,
+            )
+        return guessed
+
+    @staticmethod
+    def _reject(hooks, archive, decompressor, reason):
+        if hooks:
+            _emit(
+                hooks,
+                "decompressor_rejected",
+                archive=archive,
+                decompressor=decompressor,
+                reason=str(reason),
+            )
+        return None
+
+    def _candidates(self, mime, archive):
+        """
+        Return the cache key of a mime and an archive and the decompressors
+        to try, starting with the one found in the cache
+        """
+        extension = RE_EXTENSION.search(str(archive.realname)).group(3)
+        key = (
+            mime,
+            os.path.normcase(extension or ""),
+            tuple(getattr(archive, "_decompressors", [])),
+        )
+        hit, decompressor = self._cache_get(key)
+        candidates = self._index.get(mime, self._generic)
+        if hit:
+            if decompressor is None:
+                return key, []
+            candidates = [decompressor] + candidates
+        return key, candidates
+
+    def guess(self, archive, **options):
+        with self._thread_options(options):
+            return self._guess(archive, dict(self.options, **options))
+
+    def _guess(self, archive, options):
+        hooks = _current_hooks()
+        start = time.perf_counter()
+        mime = self.mime(archive.peek(1024))
+        if hooks:
+            _emit(
+                hooks,
+                "mime",
+                archive=archive,
+                mime=mime,
+                seconds=time.perf_counter() - start,
+            )
+        key, candidates = self._candidates(mime, archive)
+        for decompressor in candidates:
+            guessed = self._try(decompressor, mime, archive, options, hooks)
+            if guessed is not None:
+                self._cache_set(key, decompressor)
+                # NOTE: the time spent to identify the mime and to try the
+                #       decompressors
+                timings = guessed._timings
+                timings["guess"] = (
+                    time.perf_counter()
+                    - start
+                    - timings["check_availability"]
+                    - timings["init"]
                 )
-                decompressor._check_availability()
-                return decompressor(realname, archive)
-            except ValueError:
-                pass
+                return guessed
+        self._cache_set(key, None)
         return None
 
-    def open(self, name=None, fileobj=None, closefd=True):
-        archive = ArchiveFile(fileobj, name, closefd=closefd)
+    @contextmanager
+    def _thread_options(self, options):
+        """
+        Set what the archives made in the thread use: whether their reads
+        are counted (option stats) and the hooks of the guesser
+        """
+        previous = (
+            getattr(_local, "count_reads", False),
+            getattr(_local, "hooks", ()),
+        )
+        _local.count_reads = options.get(
+            "stats", self.options.get("stats", False)
+        )
+        _local.hooks = tuple(self.hooks)
+        try:
+            yield
+        finally:
+            _local.count_reads, _local.hooks = previous
+
+    def open(self, name=None, fileobj=None, closefd=True, **options):
+        with self._thread_options(options):
+            return self._open(name, fileobj, closefd, options)
+
+    def _open(self, name, fileobj, closefd, options):
+        hooks = _current_hooks()
+        start = time.perf_counter()
+        archive = None
+        if options.get("mmap", self.options.get("mmap", False)):
+            try:
+                archive = ArchiveMmap(fileobj, name, closefd=closefd)
+            except ValueError:
+                # NOTE: not a regular file
+                pass
+        if archive is None:
+            archive = ArchiveFile(fileobj, name, closefd=closefd)
+        if hooks:
+            _emit(
+                hooks,
+                "layer_opened",
+                archive=archive,
+                source=None,
+                decompressor=None,
+                seconds=time.perf_counter() - start,
+            )
 
         for i in range(self.limit):
-            guessed = self.guess(archive)
+            guessed = self.guess(archive, **options)
             if not guessed:
+                if isinstance(archive, ExternalPipe):
+                    archive._untouched = False
                 return archive
+            if isinstance(guessed, ExternalPipe):
+                # NOTE: only peeked until the next stage is guessed
+                guessed._untouched = True
             archive = guessed
 
         raise Exception("More than 10 pipes or infinite loop detected")
 
+    def map(self, function, files, workers=None, ordered=False, **options):
+        """
+        Open each file (a name or a file-object) and call function with the
+        archive on a pool of workers, yield the tuples (file, result) as they
+        complete, in the order of files if ordered
+
+        Workers can be a number of threads or an instance of
+        concurrent.futures.Executor (function must be picklable and the files
+        given by name for a process pool). At most two files per worker are
+        submitted to the pool at the same time.
+        """
+        if isinstance(workers, Executor):
+            executor = workers
+            shutdown = False
+            workers = os.cpu_count() or 1
+        else:
+            workers = workers or os.cpu_count() or 1
+            executor = ThreadPoolExecutor(workers)
+            shutdown = True
+        files = iter(files)
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < 2 * workers:
+                    file_ = next(files, None)
+                    if file_ is None:
+                        break
+                    future = executor.submit(
+                        _open_apply, self, function, file_, options
+                    )
+                    pending.append((future, file_))
+                if not pending:
+                    return
+                if ordered:
+                    future, file_ = pending.popleft()
+                    yield file_, future.result()
+                    continue
+                done, _ = wait(
+                    [future for future, _ in pending],
+                    return_when=FIRST_COMPLETED,
+                )
+                for item in [x for x in pending if x[0] in done]:
+                    pending.remove(item)
+                    yield item[1], item[0].result()
+        finally:
+            for future, _ in pending:
+                future.cancel()
+            if shutdown:
+                executor.shutdown(wait=True)
+
+
+def _open_apply(guesser, function, file_, options):
+    if isinstance(file_, (str, os.PathLike)):
+        archive = guesser.open(name=file_, **options)
+    else:
+        archive = guesser.open(fileobj=file_, **options)
+    with archive:
+        return function(archive)
 
-def open(name=None, fileobj=None, closefd=True):
+
+_guesser = None
+
+
+def _default_guesser():
+    """
+    Return the guesser used by open() and open_many(), it is made again when
+    builtin_decompressors has been changed since it was made
+    """
+    global _guesser
+    if _guesser is None or _guesser.decompressors != builtin_decompressors:
+        _guesser = Guesser()
+    return _guesser
+
+
+def open(name=None, fileobj=None, closefd=True, **options):
     """
     Use all decompressor possible to make the stream
     """
-    return Guesser().open(name=name, fileobj=fileobj, closefd=closefd)
+    return _default_guesser().open(
+        name=name, fileobj=fileobj, closefd=closefd, **options
+    )
+
+
+def open_many(function, files, workers=None, ordered=False, **options):
+    """
+    Open many files and call function with each archive on a pool of
+    workers, see Guesser.map()
+    """
+    return _default_guesser().map(
+        function, files, workers=workers, ordered=ordered, **options
+    )
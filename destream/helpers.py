@@ -1,19 +1,47 @@
 import os
 import io
 import errno
+import mmap
+import stat
 import tempfile
+import time
+import zlib
 
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
 from shutil import copyfileobj
-from subprocess import Popen, PIPE
+from subprocess import CalledProcessError, Popen, PIPE
 from threading import Thread
 from distutils.spawn import find_executable
 
 from destream import Archive
+from destream.archive import _CountingReader, _current_hooks, _emit
 
 __all__ = """
-          ArchiveFile ArchiveTemp ExternalPipe make_seekable
+          ArchiveFile ArchiveMmap ArchiveTemp ExternalPipe make_seekable spool
           """.split()
 
+ENGINES = ("auto", "internal", "external")
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_MEMORY = 256 * 1024 * 1024
+SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def read_exactly(fileobj, size):
+    """
+    Read exactly size bytes from the file-object, raise EOFError if the
+    file-object ends before
+    """
+    data = fileobj.read(size)
+    while len(data) < size:
+        chunk = fileobj.read(size - len(data))
+        if not chunk:
+            raise EOFError(
+                f"unexpected end of file: {len(data)} bytes read on {size}"
+            )
+        data += chunk
+    return data
+
 
 class ArchiveFile(Archive):
     """
@@ -30,23 +58,165 @@ class ArchiveFile(Archive):
         Archive.__init__(self, name, fileobj, source=fileobj, closefd=closefd)
 
 
+class _MmapReader(io.RawIOBase):
+    """
+    Raw stream of a memory mapping, closes the mapping and the file-object
+    """
+
+    def __init__(self, mapping, fileobj):
+        super().__init__()
+        self.mapping = mapping
+        self.fileobj = fileobj
+        self.name = getattr(fileobj, "name", None)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def close(self):
+        if not self.closed:
+            self.mapping.close()
+            self.fileobj.close()
+        super().close()
+
+
+class ArchiveMmap(ArchiveFile):
+    """
+    Make an archive from a regular file using a memory mapping
+
+    The reads are slices of the mapping: no system call and no intermediate
+    buffer, the pages are shared by the processes reading the same file.
+    Raise ValueError if the file can not be mapped (not a regular file,
+    empty file, ...).
+    """
+
+    def __init__(self, fileobj=None, name=None, closefd=True):
+        opened = not fileobj
+        if opened:
+            if not name:
+                raise TypeError("Either name, fileobj must be specified")
+            fileobj = io.FileIO(name)
+        elif not name and hasattr(fileobj, "name"):
+            name = fileobj.name
+        try:
+            fd = fileobj.fileno()
+            if not stat.S_ISREG(os.fstat(fd).st_mode):
+                raise ValueError("not a regular file")
+            position = fileobj.tell()
+            self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError) as exc:
+            if opened:
+                fileobj.close()
+            raise ValueError(f"can not map the file: {exc}") from exc
+        self._pos = position
+        Archive.__init__(
+            self,
+            name,
+            _MmapReader(self._map, fileobj),
+            source=fileobj,
+            closefd=closefd,
+        )
+
+    def _check_closed(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+    def tell(self):
+        self._check_closed()
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._check_closed()
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._map)
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"invalid whence ({whence})")
+        if offset < 0:
+            raise OSError(errno.EINVAL, "negative seek position")
+        self._pos = offset
+        return offset
+
+    def peek(self, size=0):
+        self._check_closed()
+        # NOTE: like BufferedReader, more than size bytes can be returned
+        size = max(size, io.DEFAULT_BUFFER_SIZE)
+        return self._map[self._pos : self._pos + size]
+
+    def read(self, size=-1):
+        self._check_closed()
+        if size is None or size < 0:
+            end = len(self._map)
+        else:
+            end = self._pos + size
+        data = self._map[self._pos : end]
+        self._pos += len(data)
+        return data
+
+    read1 = read
+
+    def readinto(self, b):
+        self._check_closed()
+        with memoryview(self._map) as view:
+            with view[self._pos : self._pos + len(b)] as data:
+                size = len(data)
+                b[:size] = data
+        self._pos += size
+        return size
+
+    readinto1 = readinto
+
+    def readline(self, size=-1):
+        self._check_closed()
+        end = self._map.find(b"\n", self._pos)
+        end = len(self._map) if end == -1 else end + 1
+        if size is not None and size >= 0:
+            end = min(end, self._pos + size)
+        return self.read(end - self._pos)
+
+
 class ArchiveTemp(Archive):
     """
     Write down a file-object to a temporary file and make an archive from it
     """
 
-    def __init__(self, fileobj, name=None):
+    def __init__(self, fileobj, name=None, chunk_size=CHUNK_SIZE, size=None):
         if isinstance(fileobj, Archive):
             if name is None:
                 name = fileobj.realname
-        else:
-            name = fileobj.name
+        elif name is None:
+            name = getattr(fileobj, "name", None)
         tempdir = os.path.dirname(name) if isinstance(name, str) else None
         try:
             self.tempfile = tempfile.NamedTemporaryFile(dir=tempdir)
         except OSError:
             self.tempfile = tempfile.NamedTemporaryFile()
-        self.tempfile.writelines(fileobj)
+        if size:
+            self._preallocate(size)
+        hooks = _current_hooks()
+        if hooks:
+            _emit(hooks, "spool_started", archive=self, source=fileobj)
+        start = time.perf_counter()
+        self._spooled = self._spool(fileobj, chunk_size)
+        self._spool_seconds = time.perf_counter() - start
+        if hooks:
+            _emit(
+                hooks,
+                "spool_finished",
+                archive=self,
+                source=fileobj,
+                bytes=self._spooled,
+                seconds=self._spool_seconds,
+            )
+        if size:
+            # NOTE: the size is only a hint
+            self.tempfile.truncate()
         self.tempfile.seek(0)
         # NOTE: no need (and you shouldn't need) to close the temporary file,
         #       it will be automatically closed on __del__()
@@ -54,6 +224,36 @@ class ArchiveTemp(Archive):
         fileio.name = self.tempfile.name
         Archive.__init__(self, name, fileio, source=fileobj)
 
+    def _preallocate(self, size):
+        try:
+            os.posix_fallocate(self.tempfile.fileno(), 0, size)
+        except (AttributeError, OSError):
+            # NOTE: not supported by the platform or the file system
+            pass
+
+    def _spool(self, fileobj, chunk_size):
+        # NOTE: copy using a single buffer, the memory used does not depend
+        #       on the content (writelines() would read it line by line)
+        buffer = memoryview(bytearray(chunk_size))
+        readinto = getattr(fileobj, "readinto", None)
+        spooled = 0
+        while True:
+            if readinto is not None:
+                size = readinto(buffer)
+                data = buffer[:size] if size else None
+            else:
+                data = fileobj.read(chunk_size)
+            if not data:
+                return spooled
+            self.tempfile.write(data)
+            spooled += len(data)
+
+    def _stats(self):
+        stats = super()._stats()
+        stats["spooled"] = self._spooled
+        stats["spool_seconds"] = self._spool_seconds
+        return stats
+
 
 def make_seekable(fileobj):
     """
@@ -67,6 +267,324 @@ def make_seekable(fileobj):
     return fileobj if fileobj.seekable() else ArchiveTemp(fileobj)
 
 
+class _ChainReader(io.RawIOBase):
+    """
+    Raw stream that reads file-objects one after the other
+    """
+
+    def __init__(self, *fileobjs):
+        super().__init__()
+        self.fileobjs = deque(fileobjs)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self.fileobjs:
+            fileobj = self.fileobjs[0]
+            data = getattr(fileobj, "read1", fileobj.read)(len(b))
+            if data:
+                b[: len(data)] = data
+                return len(data)
+            self.fileobjs.popleft()
+        return 0
+
+
+def spool(fileobj, max_size=SPOOL_SIZE, name=None, size=None):
+    """
+    Return a seekable copy of the file-object: in memory if its size does not
+    exceed max_size, in an ArchiveTemp otherwise (size is the expected size
+    if known)
+    """
+    data = bytearray()
+    while len(data) <= max_size:
+        chunk = fileobj.read(max_size + 1 - len(data))
+        if not chunk:
+            return io.BytesIO(data)
+        data += chunk
+    return ArchiveTemp(
+        io.BufferedReader(_ChainReader(io.BytesIO(data), fileobj)),
+        name=name if name is not None else getattr(fileobj, "name", None),
+        size=size,
+    )
+
+
+def _buffered_layers(fileobj):
+    """
+    Return the buffered readers stacked on a file descriptor and the file
+    descriptor, None if the file-object is not such a stack
+    """
+    layers = []
+    while isinstance(fileobj, (io.BufferedReader, _CountingReader)):
+        if isinstance(fileobj, io.BufferedReader):
+            layers.append(fileobj)
+        fileobj = fileobj.raw
+    if not isinstance(fileobj, io.FileIO) or fileobj.closed:
+        return None
+    return layers, fileobj.fileno()
+
+
+def _regular_file(fileobj):
+    """
+    Return a file descriptor of a regular file positioned where the
+    file-object would be read next, None if the file-object is not a regular
+    file
+    """
+    if isinstance(fileobj, ArchiveMmap) and not fileobj.closed:
+        fd = fileobj.fileno()
+        os.lseek(fd, fileobj.tell(), os.SEEK_SET)
+        return fd
+    stack = _buffered_layers(fileobj)
+    if stack is None:
+        return None
+    _, fd = stack
+    try:
+        if not stat.S_ISREG(os.fstat(fd).st_mode):
+            return None
+        # NOTE: the position takes the bytes buffered by the readers into
+        #       account
+        os.lseek(fd, fileobj.tell(), os.SEEK_SET)
+    except OSError:
+        return None
+    return fd
+
+
+class _PositionalReader(io.RawIOBase):
+    """
+    Raw stream reading a seekable file-object at its own position without
+    moving the position of the file-object: from the mapping of an
+    ArchiveMmap, using os.pread on the file descriptor of a file, under a
+    lock shared by the readers otherwise
+    """
+
+    def __init__(self, fileobj, lock):
+        super().__init__()
+        self.fileobj = fileobj
+        self._map = getattr(fileobj, "_map", None)
+        stack = _buffered_layers(fileobj)
+        self._fd = stack[1] if stack and hasattr(os, "pread") else None
+        self._lock = lock
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def _size(self):
+        if self._map is not None:
+            return len(self._map)
+        if self._fd is not None:
+            return os.fstat(self._fd).st_size
+        with self._lock:
+            pos = self.fileobj.tell()
+            size = self.fileobj.seek(0, io.SEEK_END)
+            self.fileobj.seek(pos)
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size()
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"invalid whence ({whence})")
+        if offset < 0:
+            raise OSError(errno.EINVAL, "negative seek position")
+        self._pos = offset
+        return offset
+
+    def readinto(self, b):
+        if self._map is not None:
+            with memoryview(self._map) as view:
+                with view[self._pos : self._pos + len(b)] as data:
+                    size = len(data)
+                    b[:size] = data
+            self._pos += size
+            return size
+        if self._fd is not None:
+            data = os.pread(self._fd, len(b), self._pos)
+        else:
+            with self._lock:
+                pos = self.fileobj.tell()
+                self.fileobj.seek(self._pos)
+                data = self.fileobj.read(len(b))
+                self.fileobj.seek(pos)
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _for_each(function, items, workers):
+    """
+    Call function with each item on a pool of workers (a number of threads
+    or an instance of concurrent.futures.Executor), raise the error of the
+    first item that failed
+    """
+    if isinstance(workers, Executor):
+        executor, shutdown = workers, False
+    else:
+        executor, shutdown = ThreadPoolExecutor(workers), True
+    futures = []
+    try:
+        futures = [executor.submit(function, x) for x in items]
+        for future in futures:
+            future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+        if shutdown:
+            executor.shutdown(wait=True)
+
+
+class _LimitedReader(io.RawIOBase):
+    """
+    Raw stream reading the next size bytes of a file-object
+    """
+
+    def __init__(self, fileobj, size):
+        super().__init__()
+        self.fileobj = fileobj
+        self.remaining = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = min(len(b), self.remaining)
+        if size == 0:
+            return 0
+        data = self.fileobj.read(size)
+        if not data:
+            raise EOFError(
+                f"unexpected end of file: {self.remaining} bytes missing"
+            )
+        self.remaining -= len(data)
+        b[: len(data)] = data
+        return len(data)
+
+    def skip(self):
+        while self.remaining:
+            self.read(min(self.remaining, CHUNK_SIZE))
+
+
+def _iter_command_members(command, members):
+    """
+    Run a command writing the content of the members one after the other to
+    its standard output (directories have no content) and iterate over the
+    members and their streams: (member, stream)
+
+    The streams must be read in order, what is not read is skipped when the
+    next member is requested.
+    """
+    # NOTE: the error output goes to a file, the command must not block on
+    #       it while its standard output is read
+    with tempfile.TemporaryFile() as stderr:
+        p = Popen(command, stdout=PIPE, stderr=stderr)
+        try:
+            for member in members:
+                reader = _LimitedReader(
+                    p.stdout, member.size if member.isfile() else 0
+                )
+                yield member, io.BufferedReader(reader)
+                reader.skip()
+            retcode = p.wait()
+            if retcode:
+                stderr.seek(0)
+                raise CalledProcessError(
+                    retcode, command, output=stderr.read()
+                )
+        finally:
+            p.stdout.close()
+            if p.poll() is None:
+                p.terminate()
+            p.wait()
+
+
+def _iter_command_lines(command):
+    """
+    Run a command and iterate over the lines of its output as they come,
+    raise CalledProcessError at the end if the command failed
+    """
+    p = Popen(command, stdout=PIPE)
+    try:
+        for line in p.stdout:
+            yield line.decode().rstrip("\r\n")
+        retcode = p.wait()
+        if retcode:
+            raise CalledProcessError(retcode, command)
+    finally:
+        p.stdout.close()
+        if p.poll() is None:
+            p.terminate()
+        p.wait()
+
+
+def _iter_hunks(lines):
+    """
+    Group the lines in hunks separated by empty lines
+    """
+    hunk = []
+    for line in lines:
+        if line:
+            hunk.append(line)
+        elif hunk:
+            yield "\n".join(hunk)
+            hunk = []
+    if hunk:
+        yield "\n".join(hunk)
+
+
+class _LazyList:
+    """
+    List filled from an iterator when the items are needed, on_complete is
+    called with the items once the iterator is exhausted
+    """
+
+    def __init__(self, iterator, on_complete=None):
+        self.items = []
+        self._iterator = iter(iterator)
+        self._on_complete = on_complete
+        self._complete = False
+
+    def fill(self, count=None):
+        """
+        Read the iterator until there is at least count items (all the items
+        by default)
+        """
+        while not self._complete and (
+            count is None or len(self.items) < count
+        ):
+            try:
+                self.items.append(next(self._iterator))
+            except StopIteration:
+                self._complete = True
+                if self._on_complete is not None:
+                    self._on_complete(self.items)
+        return self.items
+
+    def __iter__(self):
+        i = 0
+        while True:
+            self.fill(i + 1)
+            if i >= len(self.items):
+                return
+            yield self.items[i]
+            i += 1
+
+    def close(self):
+        if not self._complete:
+            # NOTE: the items are incomplete, on_complete is not called
+            self._complete = True
+            close = getattr(self._iterator, "close", None)
+            if close is not None:
+                close()
+
+
 class _ExternalPipeWriter(Thread):
     def __init__(self, r, w):
         super().__init__()
@@ -74,9 +592,31 @@ class _ExternalPipeWriter(Thread):
         self.r = r
         self.w = w
 
-    def run(self):
+    def _splice(self, layers, fd):
+        # NOTE: write what the readers have buffered first, then move the
+        #       rest from file descriptor to file descriptor in the kernel
+        for layer in layers:
+            data = layer.peek()
+            self.w.write(layer.read(len(data)))
+        self.w.flush()
+        out = self.w.fileno()
         try:
+            while os.splice(fd, out, CHUNK_SIZE):
+                pass
+        except OSError as exc:
+            if exc.errno != errno.EINVAL:
+                raise
+            # NOTE: the file descriptor does not support splice (a tty for
+            #       example), nothing has been moved yet
             copyfileobj(self.r, self.w)
+
+    def run(self):
+        try:
+            stack = _buffered_layers(self.r)
+            if stack is not None and hasattr(os, "splice"):
+                self._splice(*stack)
+            else:
+                copyfileobj(self.r, self.w)
         except OSError as exc:
             # NOTE: regular exception when we close the pipe, just hide it
             if exc.errno == errno.EPIPE:
@@ -87,31 +627,370 @@ class _ExternalPipeWriter(Thread):
             self.w.close()
 
 
+class ZlibDecompressor:
+    """
+    Wrap a zlib decompression object to provide the same interface than the
+    decompressors of the bz2 and lzma modules
+    """
+
+    def __init__(self, wbits=zlib.MAX_WBITS):
+        self._decompressobj = zlib.decompressobj(wbits)
+        self.needs_input = True
+
+    @property
+    def eof(self):
+        return self._decompressobj.eof
+
+    @property
+    def unused_data(self):
+        return self._decompressobj.unused_data
+
+    def copy(self):
+        """
+        Return a copy of the state of the decompressor
+        """
+        other = ZlibDecompressor.__new__(ZlibDecompressor)
+        other._decompressobj = self._decompressobj.copy()
+        other.needs_input = self.needs_input
+        return other
+
+    def decompress(self, data, max_length=-1):
+        tail = self._decompressobj.unconsumed_tail
+        if tail:
+            data = tail + data
+        if max_length < 0:
+            max_length = 0
+        output = self._decompressobj.decompress(data, max_length)
+        # NOTE: zlib may hold some output internally even when all the input
+        #       has been consumed, we only need input when the output is not
+        #       full
+        self.needs_input = not self._decompressobj.unconsumed_tail and (
+            max_length == 0 or len(output) < max_length
+        )
+        return output
+
+
+class _DecompressorReader(io.RawIOBase):
+    """
+    Raw stream that decompresses a file-object in-process using a
+    decompressor object of the zlib (wrapped), bz2 or lzma modules
+    """
+
+    def __init__(self, fileobj, decompressobj, magic=None, padding=0):
+        super().__init__()
+        self.fileobj = fileobj
+        self.decompressobj = decompressobj
+        # NOTE: magic is the signature (or a tuple of signatures) starting a
+        #       member, None if concatenated members are not supported,
+        #       padding is the alignment of the null bytes allowed between
+        #       members (xz), 0 if there can be none
+        self.magic = (magic,) if isinstance(magic, bytes) else magic
+        self.padding = padding
+        self._decompressor = decompressobj()
+        self._read = getattr(fileobj, "read1", fileobj.read)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def _next_member(self):
+        # NOTE: like gunzip, bunzip2 and unxz, concatenated members are
+        #       decompressed one after the other and trailing garbage is
+        #       ignored
+        data = self._decompressor.unused_data
+        if self.magic is None:
+            return False
+        while True:
+            while len(data) < max(map(len, self.magic)):
+                chunk = self._read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+            if not self.padding:
+                break
+            size = len(data) - len(data.lstrip(b"\0"))
+            size -= size % self.padding
+            if not size:
+                break
+            data = data[size:]
+        if not data.startswith(self.magic):
+            return False
+        self._decompressor = self.decompressobj()
+        self._pending = data
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        if size == 0:
+            return 0
+        while True:
+            if self._decompressor.eof and not self._next_member():
+                return 0
+            if self._decompressor.needs_input:
+                data, self._pending = (
+                    self._pending or self._read(CHUNK_SIZE),
+                    b"",
+                )
+                if not data:
+                    raise EOFError(
+                        "compressed file ended before the end-of-stream "
+                        "marker was reached"
+                    )
+            else:
+                data = b""
+            output = self._decompressor.decompress(data, size)
+            if output:
+                b[: len(output)] = output
+                return len(output)
+
+
+class _ParallelReader(io.RawIOBase):
+    """
+    Raw stream that decodes independent chunks on a pool of workers and
+    returns the output in the original order
+
+    The read-ahead is bounded: at most two chunks per worker and max_memory
+    bytes of input are submitted to the pool at the same time. Workers can be
+    a number of threads or an instance of concurrent.futures.Executor (the
+    decode function and the chunks must be picklable for a process pool).
+    """
+
+    def __init__(self, chunks, decode, workers, max_memory=None):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._decode = decode
+        if isinstance(workers, Executor):
+            self._executor = workers
+            self._shutdown = False
+            workers = os.cpu_count() or 1
+        else:
+            self._executor = ThreadPoolExecutor(workers)
+            self._shutdown = True
+        self._max_pending = 2 * workers
+        self._max_memory = max_memory or DEFAULT_MAX_MEMORY
+        self._pending = deque()
+        self._pending_size = 0
+        self._buffer = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def _submit(self):
+        while (
+            len(self._pending) < self._max_pending
+            and self._pending_size < self._max_memory
+        ):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            future = self._executor.submit(self._decode, chunk)
+            self._pending.append((future, len(chunk)))
+            self._pending_size += len(chunk)
+
+    def readinto(self, b):
+        while not self._buffer:
+            self._submit()
+            if not self._pending:
+                return 0
+            future, size = self._pending.popleft()
+            self._pending_size -= size
+            self._buffer = memoryview(future.result())
+        size = min(len(b), len(self._buffer))
+        b[:size] = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            for future, _ in self._pending:
+                future.cancel()
+            self._pending.clear()
+            if self._shutdown:
+                self._executor.shutdown(wait=True)
+        super().close()
+
+
 class ExternalPipe(Archive):
     """
     Pipe a file-object to a command and make an archive of the output
+
+    If the class provides an in-process decompressor (_decompressobj), the
+    engine can be selected: "internal" decompresses in-process, "external"
+    uses the command and "auto" (default) prefers the in-process decompressor
+    if available.
+
+    If the class can split its input in independent chunks (_iter_chunks),
+    the in-process engine decompresses them (_decompress_chunk) on a pool of
+    workers, see _ParallelReader.
+
+    A regular file is given as is to the command. When the guesser stacks
+    commands on a regular file, they are connected with OS pipes like in a
+    shell pipeline.
     """
 
-    def __init__(self, name, stdin):
+    _options = ["engine"]
+    _decompressobj = None
+    _magic = None
+    # NOTE: alignment of the null bytes allowed between the members
+    _padding = 0
+    _decompress_chunk = None
+    # NOTE: True while the output has only been peeked (by the guesser), the
+    #       command can then be started again with its output connected to
+    #       the command of the next stage
+    _untouched = False
+    # NOTE: the output goes straight to the command of the next layer
+    _piped = False
+    # NOTE: CPU time of the commands that have exited
+    _cpu_seconds = 0.0
+    # NOTE: the last command whose exit has been reported
+    _exited = None
+
+    def __init__(
+        self, name, stdin, engine=None, workers=None, max_memory=None
+    ):
         assert (
             type(self) is not ExternalPipe
         ), "This class can not be used in standalone"
         assert hasattr(
             self, "_command"
         ), f"_command attribute is missing in class {type(self)}"
-        self.p = Popen(self._command, stdout=PIPE, stdin=PIPE, stderr=PIPE)
+        self.engine = self._select_engine(engine)
+        self.workers = workers
+        self.max_memory = max_memory
+        self.p = None
+        self.t = None
+        self._regular_fd = None
+        self._upstream = None
+        if self.engine == "internal":
+            fileobj = self._open_internal(stdin)
+            super().__init__(name, fileobj=fileobj, source=stdin)
+            return
+        if (
+            isinstance(stdin, ExternalPipe)
+            and stdin._untouched
+            and stdin._can_respawn()
+        ):
+            self._chain(stdin)
+            super().__init__(name, fileobj=self.p.stdout, source=stdin)
+            return
+        fd = _regular_file(stdin)
+        if fd is not None:
+            # NOTE: the command reads the file itself, the file-object must
+            #       not be read anymore as the file offset is shared
+            self._regular_fd = fd, os.lseek(fd, 0, os.SEEK_CUR)
+            self._regular_size = os.fstat(fd).st_size - self._regular_fd[1]
+            self.p = self._popen(stdin=fd, stdout=PIPE)
+            super().__init__(name, fileobj=self.p.stdout, source=stdin)
+            return
+        self.p = self._popen(stdin=PIPE, stdout=PIPE)
         self.t = _ExternalPipeWriter(stdin, self.p.stdin)
         super().__init__(name, fileobj=self.p.stdout, source=stdin)
         self.t.start()
 
+    def _popen(self, stdin, stdout):
+        p = Popen(self._command, stdout=stdout, stdin=stdin, stderr=PIPE)
+        hooks = _current_hooks()
+        if hooks:
+            _emit(
+                hooks,
+                "subprocess_spawned",
+                archive=self,
+                command=list(self._command),
+                pid=p.pid,
+            )
+        return p
+
+    def _can_respawn(self):
+        if self.p is None or self.t is not None:
+            return False
+        if self._upstream is not None:
+            return self._upstream._can_respawn()
+        return self._regular_fd is not None
+
+    def _respawn(self):
+        """
+        Start the command again from the beginning of its input with its
+        output going to a new pipe, return the read end of the pipe
+        """
+        self._stop()
+        self.raw.close()
+        if self._upstream is not None:
+            stdin = self._upstream._respawn()
+        else:
+            stdin, offset = self._regular_fd
+            os.lseek(stdin, offset, os.SEEK_SET)
+        r, w = os.pipe()
+        try:
+            self.p = self._popen(stdin=stdin, stdout=w)
+        finally:
+            os.close(w)
+            if self._upstream is not None:
+                os.close(stdin)
+        return r
+
+    def _chain(self, stdin):
+        # NOTE: the previous stage is started again with its output going
+        #       straight to this command, the data does not go through
+        #       Python anymore
+        self._upstream = stdin
+        stdin._piped = True
+        r = stdin._respawn()
+        try:
+            self.p = self._popen(stdin=r, stdout=PIPE)
+        finally:
+            os.close(r)
+
+    def _open_internal(self, stdin):
+        if self.workers and self._decompress_chunk is not None:
+            chunks = self._iter_chunks(stdin)
+            if chunks is not None:
+                return _ParallelReader(
+                    chunks,
+                    self._decompress_chunk,
+                    self.workers,
+                    max_memory=self.max_memory,
+                )
+        return _DecompressorReader(
+            stdin, self._decompressobj, self._magic, self._padding
+        )
+
+    def _iter_chunks(self, stdin):
+        """
+        Return an iterator over independent chunks of the input or None if
+        the input can not be split
+        """
+        return None
+
     @classmethod
-    def _check_availability(cls):
+    def _select_engine(cls, engine=None):
+        if engine is None:
+            engine = "auto"
+        if engine not in ENGINES:
+            raise ValueError(
+                f"unknown engine {engine!r}, expected one of: "
+                + ", ".join(ENGINES)
+            )
+        internal = getattr(cls, "_decompressobj", None) is not None
+        if engine == "internal" and not internal:
+            raise OSError(
+                errno.ENOSYS,
+                f"{cls.__name__}: no in-process decompressor available",
+            )
+        if engine == "auto":
+            engine = "internal" if internal else "external"
+        return engine
+
+    @classmethod
+    def _check_availability(cls, engine=None, **options):
         assert (
             cls is not ExternalPipe
         ), "This class can not be used in standalone"
         assert hasattr(
             cls, "_command"
         ), f"_command attribute is missing in class {cls}"
+        # NOTE: also used by classes that are not ExternalPipe (Un7z, Unrar)
+        if ExternalPipe._select_engine.__func__(cls, engine) == "internal":
+            return
         commands = [cls._command[0]]
         if hasattr(cls, "__fallbackcommands__"):
             commands += cls.__fallbackcommands__
@@ -129,15 +1008,83 @@ class ExternalPipe(Archive):
 
     @property
     def closed(self):
+        if self.p is None or self.p.stdout is None:
+            return self.raw.closed
         return self.p.stdout.closed
 
+    def _stop(self):
+        # NOTE: terminate() reaps the command if it has exited, its CPU time
+        #       would be lost
+        if not self._wait(os.WNOHANG):
+            try:
+                self.p.terminate()
+            except OSError as exc:
+                if exc.errno == errno.ESRCH:
+                    pass
+                else:
+                    raise
+        if self.t is not None:
+            self.t.join()
+        self._wait()
+        self.p.stderr.close()
+
+    def _wait(self, options=0):
+        """
+        Wait for the command (unless options is os.WNOHANG) and add its CPU
+        time, return False if it is still running
+        """
+        cpu_seconds = None
+        if self.p.returncode is None:
+            try:
+                pid, status, rusage = os.wait4(self.p.pid, options)
+            except AttributeError:
+                # NOTE: os.wait4 is not available on the platform
+                self.p.wait()
+            except ChildProcessError:
+                # NOTE: already waited by the subprocess module
+                self.p.wait()
+            else:
+                if pid == 0:
+                    return False
+                if os.WIFSIGNALED(status):
+                    self.p.returncode = -os.WTERMSIG(status)
+                else:
+                    self.p.returncode = os.WEXITSTATUS(status)
+                cpu_seconds = rusage.ru_utime + rusage.ru_stime
+                self._cpu_seconds += cpu_seconds
+        # NOTE: the exit is reported once, whoever has reaped the command
+        if self._exited is self.p:
+            return True
+        self._exited = self.p
+        if self._hooks:
+            _emit(
+                self._hooks,
+                "subprocess_exited",
+                archive=self,
+                pid=self.p.pid,
+                returncode=self.p.returncode,
+                cpu_seconds=cpu_seconds,
+            )
+        return True
+
+    def _stats(self):
+        stats = super()._stats()
+        if self._piped:
+            # NOTE: only the bytes peeked by the guesser have been read
+            stats.update(bytes_out=None, read_calls=None, read_seconds=None)
+        if self.p is not None:
+            stats["cpu_seconds"] = (
+                self._cpu_seconds if self._wait(os.WNOHANG) else None
+            )
+        if self._regular_fd is not None:
+            # NOTE: the command has read the file itself
+            stats["bytes_in"] = self._regular_size
+        return stats
+
     def close(self):
         super().close()
-        try:
-            self.p.terminate()
-        except OSError as exc:
-            if exc.errno == errno.ESRCH:
-                pass
-            else:
-                raise
-        self.t.join()
+        if self.p is None:
+            return
+        self._stop()
+        if self._upstream is not None:
+            self._upstream.close()
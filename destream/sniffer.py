@@ -0,0 +1,79 @@
+import struct
+
+__all__ = """
+          sniff_mime
+          """.split()
+
+
+# NOTE: (offset, signature, mime), the mimes are the ones listed in the
+#       _mimes attribute of the decompressors
+SIGNATURES = [
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"\x28\xb5\x2f\xfd", "application/zstd"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"PK\x05\x06", "application/zip"),
+    (0, b"PK\x07\x08", "application/zip"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07\x00", "application/x-rar"),
+    (0, b"Rar!\x1a\x07\x01\x00", "application/x-rar"),
+    (257, b"ustar", "application/x-tar"),
+]
+
+BZIP2_MAGICS = (b"1AY&SY", b"\x17\x72\x45\x38\x50\x90")
+TAR_BLOCK_SIZE = 512
+
+
+def _is_bzip2(data):
+    return (
+        data[:3] == b"BZh"
+        and data[3:4].isdigit()
+        and data[3:4] != b"0"
+        and data[4:10] in BZIP2_MAGICS
+    )
+
+
+def _is_lzma(data):
+    # NOTE: the lzma_alone format has no signature, check that the header
+    #       (properties, dictionary size and uncompressed size) is sane
+    if len(data) < 13:
+        return False
+    properties, dict_size, size = struct.unpack("<BIQ", data[:13])
+    if properties >= 9 * 5 * 5:
+        return False
+    if dict_size != 0xFFFFFFFF and not any(
+        dict_size in (1 << n, (1 << n) + (1 << (n - 1))) for n in range(12, 31)
+    ):
+        return False
+    return size == 0xFFFFFFFFFFFFFFFF or size < 1 << 48
+
+
+def _is_tar(data):
+    # NOTE: old tar archives (v7) do not have the ustar signature, check the
+    #       header checksum
+    if len(data) < TAR_BLOCK_SIZE:
+        return False
+    header = data[:TAR_BLOCK_SIZE]
+    try:
+        checksum = int(header[148:156].strip(b"\0 ") or b"-1", 8)
+    except ValueError:
+        return False
+    computed = sum(header[:148]) + sum(header[156:]) + 8 * ord(" ")
+    return checksum == computed and header[0] != 0
+
+
+def sniff_mime(data):
+    """
+    Identify the formats supported by the builtin decompressors using their
+    signature, return the mime or None if the format is not identified
+    """
+    for offset, signature, mime in SIGNATURES:
+        if data[offset : offset + len(signature)] == signature:
+            return mime
+    if _is_bzip2(data):
+        return "application/x-bzip2"
+    if _is_tar(data):
+        return "application/x-tar"
+    if _is_lzma(data):
+        return "application/x-lzma"
+    return None
@@ -14,8 +14,11 @@ setup(
     url="https://github.com/destream-py/destream",
     packages=find_packages(),
     scripts=["scripts/destream"],
-    install_requires=["python-magic>=0.4.12"],
-    extras_require={"test": ["tox", "pytest", "pytest-cov"]},
+    extras_require={
+        "magic": ["python-magic>=0.4.12"],
+        "test": ["tox", "pytest", "pytest-cov", "python-magic>=0.4.12"],
+        "zstd": ["zstandard"],
+    },
     classifiers=[
         "Development Status :: 5 - Production/Stable",
         "Topic :: System :: Archiving :: Compression",
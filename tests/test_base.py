@@ -1,9 +1,31 @@
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 from pathlib import Path
+from subprocess import CalledProcessError
 
 import pytest
 
-from destream import Archive, ArchiveFile, ArchiveTemp, ExternalPipe
+from destream import (
+    Archive,
+    ArchiveFile,
+    ArchiveMmap,
+    ArchiveTemp,
+    ExternalPipe,
+    Guesser,
+    ListingCache,
+    add_hook,
+    builtin_decompressors,
+    open_many,
+    remove_hook,
+)
+from destream.helpers import (
+    _LazyList,
+    _iter_command_lines,
+    _iter_command_members,
+    _iter_hunks,
+)
 
 
 class BaseNameExample(Archive):
@@ -52,6 +74,7 @@ def test_archivefile_closefd():
     archive.close()
     assert fileobj.closed
 
+
 # This is a simple decompressor that does absolutely nothing. Great for testing.
 class CatsEye(ExternalPipe):
     _command = ["cat"]
@@ -84,3 +107,369 @@ def test_create_temp_archive_from_externalpipe():
             Path(filename).resolve().parent == Path(temp.name).resolve().parent
         )
         assert temp.read() == text
+
+
+class RecordingBytesIO(BytesIO):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.sizes = []
+
+    def readinto(self, b):
+        self.sizes.append(len(b))
+        return super().readinto(b)
+
+
+@pytest.mark.parametrize("size", [None, 1000, 300000, 10**6])
+def test_temp_archive_chunked(size):
+    text = b"\0" * 300000
+    fileobj = RecordingBytesIO(text)
+    temp = ArchiveTemp(fileobj, chunk_size=4096, size=size)
+    assert max(fileobj.sizes) == 4096
+    assert os.fstat(temp.fileno()).st_size == len(text)
+    assert temp.read() == text
+
+
+def test_temp_archive_stats():
+    text = b"\0" * 300000
+    temp = ArchiveTemp(BytesIO(text), chunk_size=4096)
+    assert temp.read() == text
+    (stats,) = temp.stats()
+    assert stats["layer"] == "ArchiveTemp"
+    assert stats["spooled"] == len(text)
+    assert stats["spool_seconds"] >= 0
+    # NOTE: the reads are only counted with the option stats
+    assert stats["bytes_out"] is None
+
+
+def test_mmap_archive(tmp_path):
+    path = tmp_path / "test_file"
+    path.write_bytes(b"Hello\nWorld\n" + b"\0" * 10000)
+    with open(path, "rb") as fh:
+        fh.read(6)
+        archive = ArchiveMmap(fh)
+        assert archive.realname == str(path)
+        assert archive.tell() == 6
+        assert archive.peek(3).startswith(b"World\n")
+        assert archive.readline() == b"World\n"
+        buffer = bytearray(4)
+        assert archive.readinto(buffer) == 4
+        assert buffer == b"\0" * 4
+        assert archive.seek(-2, os.SEEK_END) == 10010
+        assert archive.read() == b"\0\0"
+        assert archive.read() == b""
+        assert archive.seek(0) == 0
+        assert list(archive)[0] == b"Hello\n"
+        archive.close()
+        assert fh.closed
+        with pytest.raises(ValueError):
+            archive.read()
+    for fileobj in [BytesIO(b"Hello"), open(tmp_path / "empty", "wb+")]:
+        with pytest.raises(ValueError):
+            ArchiveMmap(fileobj)
+
+
+class CountingCatsEye(CatsEye):
+    _mimes = ["text/x-cats-eye"]
+    _extensions = ["cat"]
+    guessed = 0
+
+    @classmethod
+    def _guess(cls, mime, name, fileobj):
+        cls.guessed += 1
+        return super()._guess(mime, name, fileobj)
+
+
+def test_guesser_add_decompressors():
+    builtins = list(builtin_decompressors)
+    guesser = Guesser(extra_decompressors=[(-1, CountingCatsEye)])
+    assert builtin_decompressors == builtins
+    assert guesser._index["text/x-cats-eye"] == [CountingCatsEye]
+    guesser = Guesser()
+    assert "text/x-cats-eye" not in guesser._index
+    guesser.add_decompressors([(-1, CountingCatsEye), (0, CatsEye)])
+    assert guesser._index["text/x-cats-eye"] == [CountingCatsEye, CatsEye]
+    assert guesser._index["application/gzip"][-1] is CatsEye
+    assert guesser._generic == [CatsEye]
+
+
+@pytest.mark.parametrize("cache_size,guessed", [(256, 4), (1, 6), (0, 6)])
+def test_guesser_cache(monkeypatch, cache_size, guessed):
+    monkeypatch.setattr(
+        Guesser, "mime", staticmethod(lambda data: "text/x-cats-eye")
+    )
+    guesser = Guesser(
+        decompressors=[(0, CountingCatsEye)], cache_size=cache_size
+    )
+    CountingCatsEye.guessed = 0
+    for i in range(3):
+        with guesser.open(fileobj=BytesIO(b"Hello"), name="a.cat") as archive:
+            assert archive.compressions == ["cat"]
+            assert archive.realname == "a"
+            assert archive.read() == b"Hello"
+    # NOTE: the second layer is cached as not decompressable (CatsEye is a
+    #       unique instance)
+    assert CountingCatsEye.guessed == guessed
+    assert len(guesser._cache) == min(cache_size, 2)
+
+
+def test_default_guesser_follows_builtins():
+    from destream.guesser import _default_guesser
+
+    guesser = _default_guesser()
+    assert _default_guesser() is guesser
+    builtin_decompressors.append((-1, CountingCatsEye))
+    try:
+        assert (-1, CountingCatsEye) in _default_guesser().decompressors
+    finally:
+        builtin_decompressors.remove((-1, CountingCatsEye))
+    assert (-1, CountingCatsEye) not in _default_guesser().decompressors
+
+
+def test_guesser_hooks():
+    events = []
+
+    def hook(event):
+        events.append(("global", event))
+
+    guesser = Guesser(engine="internal")
+    guesser.add_hook(lambda event: events.append(("guesser", event)))
+    add_hook(hook)
+    try:
+        fileobj = BytesIO(gzip.compress(b"Hello World\n"))
+        with guesser.open(fileobj=fileobj, name="a.gz") as archive:
+            assert archive.read() == b"Hello World\n"
+    finally:
+        remove_hook(hook)
+    # NOTE: the global hooks are called first
+    assert [x for x, _ in events[:2]] == ["global", "guesser"]
+    events = [x for hook, x in events if hook == "guesser"]
+    assert events == sorted(events, key=lambda x: x["time"])
+    names = [x["event"] for x in events if x["event"] != "read"]
+    assert names[:4] == [
+        "layer_opened",
+        "mime",
+        "decompressor_tried",
+        "layer_opened",
+    ]
+    opened = [x for x in events if x["event"] == "layer_opened"]
+    assert opened[1]["archive"] is archive
+    assert opened[1]["source"] is opened[0]["archive"]
+    assert opened[1]["decompressor"].__name__ == "Gunzip"
+    mime = [x for x in events if x["event"] == "mime"]
+    assert mime[0]["mime"] == "application/gzip"
+    assert mime[1]["archive"] is archive
+    reads = [x for x in events if x["event"] == "read"]
+    assert sum(x["bytes"] for x in reads if x["archive"] is archive) == 12
+    (closed,) = [
+        x
+        for x in events
+        if x["event"] == "layer_closed" and x["archive"] is archive
+    ]
+    assert closed["bytes"] == 12
+    # NOTE: the reads are not wrapped without hooks
+    with Guesser().open(fileobj=BytesIO(gzip.compress(b"Hello"))) as archive:
+        assert archive._counter is None
+
+
+def test_guesser_hooks_command():
+    events = []
+    guesser = Guesser(decompressors=[(0, CatsEye)])
+    guesser.add_hook(events.append)
+    with guesser.open(fileobj=BytesIO(b"Hello"), name="a.cat") as archive:
+        assert archive.read() == b"Hello"
+    names = [x["event"] for x in events if x["event"] != "read"]
+    assert names == [
+        "layer_opened",
+        "mime",
+        "decompressor_tried",
+        "subprocess_spawned",
+        "layer_opened",
+        "mime",
+        "decompressor_tried",
+        "decompressor_rejected",
+        "layer_closed",
+        "subprocess_exited",
+    ]
+    spawned, exited = [x for x in events if "pid" in x]
+    assert spawned["archive"] is exited["archive"] is archive
+    assert spawned["pid"] == exited["pid"] == archive.p.pid
+    assert spawned["command"] == CatsEye._command
+    assert exited["returncode"] is not None
+    (rejected,) = [x for x in events if x["event"] == "decompressor_rejected"]
+    assert rejected["decompressor"] is CatsEye
+    assert "already in the decompressor list" in rejected["reason"]
+
+
+def test_guesser_hooks_command_reaped():
+    events = []
+    guesser = Guesser(decompressors=[(0, CatsEye)])
+    guesser.add_hook(events.append)
+    with guesser.open(fileobj=BytesIO(b"Hello"), name="a.cat") as archive:
+        assert archive.read() == b"Hello"
+        # NOTE: the command is reaped by the subprocess module
+        archive.p.wait()
+        archive.stats()
+    archive.stats()
+    (exited,) = [x for x in events if x["event"] == "subprocess_exited"]
+    assert exited["pid"] == archive.p.pid
+    assert exited["returncode"] == 0
+
+
+def test_temp_archive_hooks():
+    events = []
+    add_hook(events.append)
+    try:
+        temp = ArchiveTemp(BytesIO(b"\0" * 300000), chunk_size=4096)
+    finally:
+        remove_hook(events.append)
+    assert [x["event"] for x in events] == ["spool_started", "spool_finished"]
+    assert events[1]["archive"] is temp
+    assert events[1]["bytes"] == 300000
+    assert events[1]["time"] >= events[0]["time"]
+
+
+def _read_archive(archive):
+    return archive.read()
+
+
+@pytest.mark.parametrize("ordered", [False, True])
+def test_guesser_map(tmp_path, ordered):
+    files = []
+    for i in range(20):
+        path = tmp_path / f"test_file_{i}.gz"
+        path.write_bytes(gzip.compress(b"Hello %d\n" % i))
+        files.append(str(path))
+    results = list(Guesser().map(_read_archive, files, 3, ordered=ordered))
+    if ordered:
+        assert [x for x, _ in results] == files
+    assert sorted(results) == sorted(
+        (x, b"Hello %d\n" % i) for i, x in enumerate(files)
+    )
+    with ProcessPoolExecutor(2) as executor:
+        results = open_many(_read_archive, files, executor, ordered=ordered)
+        assert {x: y for x, y in results} == dict(
+            (x, b"Hello %d\n" % i) for i, x in enumerate(files)
+        )
+
+
+def test_guesser_map_error():
+    files = [BytesIO(gzip.compress(b"Hello\n")), BytesIO(b"\x1f\x8bxxx")]
+    with pytest.raises(Exception):
+        list(open_many(_read_archive, files, 2, ordered=True))
+
+
+class SizedMember:
+    def __init__(self, filename, size=None):
+        self.filename = filename
+        self.size = size
+
+    def isfile(self):
+        return self.size is not None
+
+
+def test_iter_command_members(tmp_path):
+    path = tmp_path / "members"
+    path.write_bytes(b"Hello World\n" + b"\0" * 100000 + b"end")
+    members = [
+        SizedMember("a", 12),
+        SizedMember("b"),
+        SizedMember("b/c", 100000),
+        SizedMember("d", 0),
+        SizedMember("e", 3),
+    ]
+    iterator = _iter_command_members(["cat", str(path)], members)
+    member, stream = next(iterator)
+    assert member.filename == "a"
+    assert stream.read() == b"Hello World\n"
+    member, stream = next(iterator)
+    assert stream.read() == b""
+    member, stream = next(iterator)
+    # NOTE: not read until the end
+    assert stream.read(10) == b"\0" * 10
+    assert [(m.filename, s.read()) for m, s in iterator] == [
+        ("d", b""),
+        ("e", b"end"),
+    ]
+
+
+def test_iter_command_members_error():
+    members = [SizedMember("a", 2)]
+    iterator = _iter_command_members(
+        ["sh", "-c", "printf ab; echo failed >&2; exit 3"], members
+    )
+    assert next(iterator)[1].read() == b"ab"
+    with pytest.raises(CalledProcessError) as excinfo:
+        next(iterator)
+    assert excinfo.value.output == b"failed\n"
+    iterator = _iter_command_members(["sh", "-c", "printf a"], members)
+    with pytest.raises(EOFError):
+        next(iterator)[1].read()
+
+
+def test_listing_cache(tmp_path):
+    cache = ListingCache(str(tmp_path / "cache"), max_size=1000)
+    assert cache.get("7z", "key1") is None
+    cache.set("7z", "key1", {"members": [{"filename": "a", "size": 1}]})
+    assert cache.get("7z", "key1") == {
+        "members": [{"filename": "a", "size": 1}]
+    }
+    assert cache.get("rar", "key1") is None
+    # NOTE: the least recently used entries are removed first
+    cache.set("7z", "key2", "x" * 400)
+    os.utime(cache._filename("7z", "key2"), ns=(0, 0))
+    cache.set("7z", "key3", "x" * 400)
+    cache.set("7z", "key4", "x" * 400)
+    assert cache.get("7z", "key2") is None
+    assert cache.get("7z", "key4") is not None
+    cache.clear()
+    assert os.listdir(cache.path) == []
+
+
+def test_listing_cache_keys(tmp_path):
+    path = tmp_path / "testfile"
+    path.write_bytes(b"Hello World\n")
+    with path.open("rb") as fileobj:
+        key = ListingCache.file_key(ArchiveFile(fileobj, closefd=False))
+        assert key.startswith("file:")
+        fileobj.seek(1)
+        assert ListingCache.file_key(fileobj) != key
+    os.utime(path, ns=(0, 0))
+    with path.open("rb") as fileobj:
+        assert ListingCache.file_key(fileobj) != key
+    assert ListingCache.file_key(BytesIO(b"Hello World\n")) is None
+    fileobj = BytesIO(b"Hello World\n")
+    fileobj.seek(5)
+    key = ListingCache.content_key(fileobj)
+    assert fileobj.tell() == 5
+    assert key == ListingCache.content_key(BytesIO(b"Hello World\n"))
+    assert key != ListingCache.content_key(BytesIO(b"Hello World!\n"))
+
+
+def test_iter_command_lines_hunks():
+    lines = _iter_command_lines(["printf", "\\na: 1\\nb: 2\\n\\n\\nc: 3\\n"])
+    assert list(_iter_hunks(lines)) == ["a: 1\nb: 2", "c: 3"]
+    with pytest.raises(CalledProcessError):
+        list(_iter_command_lines(["sh", "-c", "echo a; exit 1"]))
+
+
+def test_lazy_list():
+    completed = []
+    consumed = []
+
+    def iterator():
+        for i in range(5):
+            consumed.append(i)
+            yield i
+
+    listing = _LazyList(iterator(), on_complete=completed.append)
+    assert listing.fill(2) == [0, 1]
+    assert consumed == [0, 1]
+    assert next(iter(listing)) == 0
+    assert consumed == [0, 1]
+    assert list(listing) == [0, 1, 2, 3, 4]
+    assert completed == [[0, 1, 2, 3, 4]]
+    listing = _LazyList(iterator(), on_complete=completed.append)
+    listing.fill(1)
+    listing.close()
+    assert listing.fill() == [0]
+    assert len(completed) == 1
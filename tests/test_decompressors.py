@@ -1,7 +1,16 @@
+import asyncio
+import bz2
 import gzip
+import io
+import lzma
 import os
+import shutil
+import struct
+import subprocess
+import zlib
 import tarfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
@@ -74,6 +83,13 @@ def check_decompressor(
                 decompressed_fileobj.seek(0)
                 assert fileobj.read() == decompressed_fileobj.read()
 
+            # test iter_members()
+            for member, fileobj in archive.iter_members():
+                if hasattr(member, "isfile") and not member.isfile():
+                    continue
+                decompressed_fileobj.seek(0)
+                assert fileobj.read() == decompressed_fileobj.read()
+
             # test extract()
             tempdir1 = tempdir / "test_extract"
             tempdir1.mkdir()
@@ -281,6 +297,16 @@ def test_guess_7z_multiple_files(tmp_path):
     check_decompressor(
         tmp_path, destream.decompressors.Un7z, raw, uncompressed
     )
+    # NOTE: the second time the listing is read from the cache
+    cache = destream.ListingCache(str(tmp_path / "cache"))
+    listings = []
+    for _ in range(2):
+        raw.seek(0)
+        with destream.open(fileobj=raw, listing_cache=cache) as archive:
+            assert not archive.single()
+            listings.append([vars(x) for x in archive.members()])
+    assert listings[0] == listings[1]
+    assert len(os.listdir(cache.path)) == 1
 
 
 @pytest.mark.xfail(
@@ -391,16 +417,1081 @@ def test_object_closed_on_delete(tmp_path):
         with gzip.open(path, "w+b") as gzipped:
             for i in range(3000):
                 gzipped.write(os.urandom(1024))
-        archive = destream.open(fh.name)
+        archive = destream.open(fh.name, engine="external")
         assert destream.decompressors.Gunzip in archive._decompressors
         proc = archive.p
-        thread = archive.t
+        # NOTE: the file is given to the command, no thread writes it
+        assert archive.t is None
         del archive
         assert proc.poll() is not None
-        assert not thread.is_alive()
-        archive2 = destream.open(fh.name)
+        archive2 = destream.open(fh.name, engine="external")
         proc2 = archive2.p
-        thread2 = archive2.t
         del archive2
         assert proc2.poll() is not None
-        assert not thread2.is_alive()
+        archive3 = destream.open(
+            fileobj=BytesIO(path.read_bytes()), engine="external"
+        )
+        proc3 = archive3.p
+        thread3 = archive3.t
+        del archive3
+        assert proc3.poll() is not None
+        assert not thread3.is_alive()
+
+
+def test_external_pipe_file_descriptor(tmp_path):
+    data = os.urandom(300000)
+    path = tmp_path / "test_file.gz"
+    path.write_bytes(b"garbage" + gzip.compress(data))
+    with path.open("rb") as fileobj:
+        fileobj.seek(len(b"garbage"))
+        archive = destream.ArchiveFile(fileobj, closefd=False)
+        # NOTE: bytes buffered by the readers
+        archive.peek(1024)
+        with destream.decompressors.Gunzip(
+            "test_file.gz", archive, engine="external"
+        ) as gz:
+            assert gz.t is None
+            assert gz.read() == data
+
+
+def test_external_pipe_splice():
+    data = os.urandom(300000)
+    raw = BytesIO(gzip.compress(gzip.compress(data)))
+    Gunzip = destream.decompressors.Gunzip
+    with Gunzip("test_file.gz.gz", raw, engine="external") as stage1:
+        # NOTE: bytes buffered by the readers
+        stage1.peek(1024)
+        # NOTE: the output of the first command is moved to the second one
+        with Gunzip("test_file.gz", stage1, engine="external") as stage2:
+            assert stage2.t is not None
+            assert stage2.read() == data
+
+
+@pytest.mark.parametrize(
+    "decompressor,compress",
+    [
+        (destream.decompressors.Gunzip, gzip.compress),
+        (destream.decompressors.Bunzip2, bz2.compress),
+        (destream.decompressors.Unxz, lzma.compress),
+    ],
+)
+@pytest.mark.parametrize("engine", ["internal", "external"])
+def test_engine_concatenated_members(decompressor, compress, engine):
+    try:
+        decompressor._check_availability(engine=engine)
+    except Exception:
+        pytest.skip("decompressor not available")
+    data = [os.urandom(100) * 1000, b"Hello World\n" * 1000]
+    raw = BytesIO(b"".join(compress(x) for x in data))
+    raw.name = f"test_file.{decompressor._extensions[0]}"
+    with destream.open(fileobj=raw, engine=engine) as archive:
+        assert archive._decompressors[-1] is decompressor
+        assert archive.engine == engine
+        assert archive.realname == "test_file"
+        assert archive.compressions == [decompressor._compression]
+        assert archive.read() == b"".join(data)
+
+
+@pytest.mark.parametrize("engine", ["internal", "external"])
+def test_xz_stream_padding(engine):
+    data = [os.urandom(100) * 1000, b"Hello World\n" * 1000, b"end"]
+    # NOTE: stream padding between the streams and at the end
+    raw = BytesIO(
+        lzma.compress(data[0])
+        + b"\0" * 4
+        + lzma.compress(data[1])
+        + b"\0" * 1024
+        + lzma.compress(data[2])
+        + b"\0" * 8
+    )
+    raw.name = "test_file.xz"
+    with destream.open(fileobj=raw, engine=engine) as archive:
+        assert archive.read() == b"".join(data)
+
+
+def test_engine_internal_lzma():
+    data = b"Hello World\n" * 1000
+    raw = BytesIO(lzma.compress(data, format=lzma.FORMAT_ALONE))
+    raw.name = "test_file.lzma"
+    guesser = destream.Guesser(engine="internal")
+    with guesser.open(fileobj=raw) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Unlzma
+        assert archive.p is None
+        assert archive.read() == data
+
+
+def test_engine_internal_truncated():
+    raw = BytesIO(gzip.compress(b"Hello World\n" * 1000)[:-20])
+    raw.name = "test_file.gz"
+    with destream.open(fileobj=raw, engine="internal") as archive:
+        with pytest.raises(EOFError):
+            archive.read()
+
+
+def test_engine_invalid():
+    raw = BytesIO(gzip.compress(b"Hello World\n"))
+    with pytest.raises(ValueError):
+        destream.open(fileobj=raw, engine="invalid")
+
+
+@pytest.mark.parametrize("workers", [None, 4])
+def test_zstd_internal_frames(workers):
+    zstandard = pytest.importorskip("zstandard")
+    try:
+        destream.decompressors.Unzstd._check_availability(engine="internal")
+    except Exception:
+        pytest.skip("decompressor not available")
+    compressor = zstandard.ZstdCompressor(write_checksum=True)
+    data = [os.urandom(10) * 10000, b"", os.urandom(300000), b"a" * 150000]
+    # NOTE: skippable frame in the middle of the stream
+    skippable = b"\x50\x2a\x4d\x18\x04\x00\x00\x00abcd"
+    frames = [compressor.compress(x) for x in data]
+    raw = BytesIO(b"".join(frames[:2]) + skippable + b"".join(frames[2:]))
+    raw.name = "test_file.zst"
+    with destream.open(fileobj=raw, workers=workers) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Unzstd
+        assert archive.engine == "internal"
+        assert archive.realname == "test_file"
+        assert archive.read() == b"".join(data)
+
+
+def test_zstd_decompressor_max_length():
+    zstandard = pytest.importorskip("zstandard")
+    from destream.decompressors.zstd import ZstandardDecompressor
+
+    data = b"a" * 10**7 + os.urandom(100000)
+    compressed = zstandard.ZstdCompressor().compress(data) + b"garbage"
+    decompressor = ZstandardDecompressor()
+    chunks = [decompressor.decompress(compressed, 65536)]
+    while not decompressor.eof:
+        assert len(chunks[-1]) <= 65536
+        chunks.append(decompressor.decompress(b"", 65536))
+    assert b"".join(chunks) == data
+    assert decompressor.unused_data == b"garbage"
+
+
+def zstd_seekable_compress(chunks, checksum=False, sizes=None):
+    zstandard = pytest.importorskip("zstandard")
+    compressor = zstandard.ZstdCompressor()
+    frames = [compressor.compress(x) for x in chunks]
+    sizes = sizes or [len(x) for x in chunks]
+    table = b"".join(
+        struct.pack("<II", len(frame), size)
+        + (b"\0\0\0\0" if checksum else b"")
+        for frame, size in zip(frames, sizes)
+    )
+    table += struct.pack("<IB", len(frames), 0x80 if checksum else 0)
+    table += struct.pack("<I", 0x8F92EAB1)
+    return (
+        b"".join(frames) + struct.pack("<II", 0x184D2A5E, len(table)) + table
+    )
+
+
+@pytest.mark.parametrize("workers", [None, 3])
+@pytest.mark.parametrize("checksum", [False, True])
+def test_zstd_seekable(workers, checksum):
+    try:
+        destream.decompressors.Unzstd._check_availability(engine="internal")
+    except Exception:
+        pytest.skip("decompressor not available")
+    chunks = [os.urandom(100000), b"", bytes(100000), os.urandom(5)] * 5
+    data = b"".join(chunks)
+    raw = BytesIO(zstd_seekable_compress(chunks, checksum=checksum))
+    raw.name = "test_file.zst"
+    with destream.open(fileobj=raw, workers=workers) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Unzstd
+        assert archive.seekable()
+        assert archive.seek(0, io.SEEK_END) == len(data)
+        for pos, size in [
+            (150000, 1000),
+            (99990, 200020),
+            (len(data) - 3, 10),
+            (0, len(data)),
+            (len(data) + 10, 10),
+        ]:
+            assert archive.seek(pos) == pos
+            assert archive.read(size) == data[pos : pos + size]
+
+
+def test_zstd_seekable_invalid():
+    try:
+        destream.decompressors.Unzstd._check_availability(engine="internal")
+    except Exception:
+        pytest.skip("decompressor not available")
+    chunks = [b"Hello ", b"World\n"]
+    # NOTE: the frames do not match the seek table
+    raw = BytesIO(zstd_seekable_compress(chunks, sizes=[6, 7]))
+    raw.name = "test_file.zst"
+    with destream.open(fileobj=raw) as archive:
+        with pytest.raises(OSError):
+            archive.read()
+    # NOTE: without a valid seek table, the file is decompressed as a stream
+    raw = BytesIO(zstd_seekable_compress(chunks)[:-1] + b"\0")
+    raw.name = "test_file.zst"
+    with destream.open(fileobj=raw) as archive:
+        assert not archive.seekable()
+        assert archive.read() == b"Hello World\n"
+
+
+def _tar_bytes(format):
+    raw = BytesIO()
+    with tarfile.open(fileobj=raw, mode="w", format=format) as tar:
+        tarinfo = tarfile.TarInfo("test_file")
+        tarinfo.size = 12
+        tar.addfile(tarinfo, BytesIO(b"Hello World\n"))
+    return raw.getvalue()
+
+
+def _zip_bytes():
+    raw = BytesIO()
+    with zipfile.ZipFile(raw, "w") as zipf:
+        zipf.writestr("test_file", b"Hello World\n")
+    return raw.getvalue()
+
+
+@pytest.mark.parametrize(
+    "decompressor,data",
+    [
+        (destream.decompressors.Gunzip, gzip.compress(b"Hello World\n")),
+        (destream.decompressors.Bunzip2, bz2.compress(b"Hello World\n")),
+        (destream.decompressors.Bunzip2, bz2.compress(b"")),
+        (destream.decompressors.Unxz, lzma.compress(b"Hello World\n")),
+        (
+            destream.decompressors.Unlzma,
+            lzma.compress(b"Hello World\n", format=lzma.FORMAT_ALONE),
+        ),
+        (destream.decompressors.Unzstd, b"\x28\xb5\x2f\xfd\x24\x00"),
+        (destream.decompressors.Unzip, _zip_bytes()),
+        (destream.decompressors.Untar, _tar_bytes(tarfile.GNU_FORMAT)),
+        (destream.decompressors.Untar, _tar_bytes(tarfile.PAX_FORMAT)),
+        (destream.decompressors.Untar, _tar_bytes(tarfile.USTAR_FORMAT)),
+        (destream.decompressors.Un7z, b"7z\xbc\xaf\x27\x1c\x00\x04"),
+        (destream.decompressors.Unrar, b"Rar!\x1a\x07\x00\xcf\x90"),
+        (destream.decompressors.Unrar, b"Rar!\x1a\x07\x01\x00\x33"),
+    ],
+)
+def test_sniff_mime(decompressor, data):
+    assert destream.sniff_mime(data) in decompressor._mimes
+
+
+def test_sniff_mime_v7_tar():
+    data = bytearray(_tar_bytes(tarfile.USTAR_FORMAT))
+    data[257:265] = b"\0" * 8
+    data[148:156] = b"        "
+    data[148:155] = b"%06o\0" % (sum(data[:512]))
+    assert destream.sniff_mime(bytes(data)) == "application/x-tar"
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"Hello World\n", b"\0" * 1024, b"BZh0", b"PK"]
+)
+def test_sniff_mime_unknown(data):
+    assert destream.sniff_mime(data) is None
+    assert destream.Guesser.mime(data) == magic.from_buffer(data, mime=True)
+
+
+def bgzf_compress(data, block_size=65280):
+    blocks = []
+    for i in range(0, len(data) + 1, block_size):
+        chunk = data[i : i + block_size]
+        compressobj = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = compressobj.compress(chunk) + compressobj.flush()
+        header = b"\x1f\x8b\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0"
+        trailer = struct.pack("<II", zlib.crc32(chunk), len(chunk))
+        bsize = len(header) + 2 + len(deflated) + len(trailer) - 1
+        blocks.append(header + struct.pack("<H", bsize) + deflated + trailer)
+    return b"".join(blocks)
+
+
+@pytest.mark.parametrize(
+    "compress,tail,garbage",
+    [
+        (bgzf_compress, b"", b""),
+        (bgzf_compress, b"Hello World\n", b"\0" * 10),
+        (gzip.compress, b"Hello World\n", b""),
+    ],
+)
+def test_gzip_parallel_members(compress, tail, garbage):
+    data = os.urandom(100) * 10000 + os.urandom(300000)
+    raw = BytesIO(compress(data) + (tail and gzip.compress(tail)) + garbage)
+    raw.name = "test_file.gz"
+    expected = data + tail
+    with destream.open(fileobj=raw, workers=4, max_memory=100000) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Gunzip
+        assert archive.realname == "test_file"
+        assert archive.read() == expected
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_bzip2_parallel_blocks(workers):
+    data = [
+        bytes(x % 7 for x in os.urandom(700000)),
+        b"",
+        b"Hello World\n",
+        os.urandom(250000),
+    ]
+    raw = BytesIO(
+        bz2.compress(data[0], 1)
+        + b"".join(bz2.compress(x) for x in data[1:])
+        + b"garbage"
+    )
+    raw.name = "test_file.bz2"
+    with destream.open(fileobj=raw, workers=workers) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Bunzip2
+        assert archive.realname == "test_file"
+        assert archive.read() == b"".join(data)
+
+
+def test_bzip2_parallel_blocks_count():
+    data = bytes(x % 7 for x in os.urandom(700000))
+    blocks = list(
+        destream.decompressors.bzip2.iter_blocks(
+            BytesIO(bz2.compress(data, 1)), read_size=1000
+        )
+    )
+    assert len(blocks) > 2
+    assert b"".join(bz2.decompress(x) for x in blocks) == data
+
+
+def xz_multiblock_compress(data, block_size):
+    xz = shutil.which("xz")
+    if xz:
+        return subprocess.run(
+            [xz, "-T2", f"--block-size={block_size}", "-c"],
+            input=data,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+    # NOTE: one stream per block
+    return b"".join(
+        lzma.compress(data[i : i + block_size])
+        for i in range(0, len(data), block_size)
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_xz_parallel_blocks(workers, tmp_path):
+    data = bytes(x % 7 for x in os.urandom(500000)) + os.urandom(300000)
+    # NOTE: multiple streams and stream padding
+    compressed = (
+        xz_multiblock_compress(data, 100000)
+        + b"\0" * 8
+        + lzma.compress(b"Hello World\n")
+    )
+    blocks = destream.decompressors.xz.read_blocks(BytesIO(compressed))
+    assert len(blocks) == 9
+    path = tmp_path / "test_file.xz"
+    path.write_bytes(compressed)
+    with destream.open(path, workers=workers) as archive:
+        assert archive._decompressors[-1] is destream.decompressors.Unxz
+        assert archive.realname == str(tmp_path / "test_file")
+        assert archive.read() == data + b"Hello World\n"
+
+
+class NonSeekable(io.RawIOBase):
+    def __init__(self, data, name=None):
+        self.fileobj = BytesIO(data)
+        if name is not None:
+            self.name = name
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.fileobj.read(min(len(b), 1000))
+        b[: len(data)] = data
+        return len(data)
+
+
+def _zip_members(files, compression, seekable):
+    raw = BytesIO()
+    fileobj = raw if seekable else NonSeekable(b"")
+    if not seekable:
+        fileobj.write = raw.write
+        fileobj.flush = raw.flush
+        fileobj.writable = lambda: True
+    with zipfile.ZipFile(fileobj, "w", compression) as zipf:
+        for filename, data in files:
+            if data is None:
+                zipf.writestr(zipfile.ZipInfo(filename + "/"), b"")
+            else:
+                zipf.writestr(filename, data)
+    return raw.getvalue()
+
+
+@pytest.mark.parametrize(
+    "compression,seekable",
+    [
+        (zipfile.ZIP_STORED, True),
+        (zipfile.ZIP_DEFLATED, True),
+        (zipfile.ZIP_DEFLATED, False),
+        (zipfile.ZIP_BZIP2, False),
+    ],
+)
+def test_zip_streaming_multiple_files(tmp_path, compression, seekable):
+    files = [
+        ("a", None),
+        ("a/test_file1", os.urandom(100) * 1000),
+        ("b/test_file2", b""),
+        ("b/test_file3", b"Hello World\n"),
+    ]
+    data = _zip_members(files, compression, seekable)
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert isinstance(archive, destream.decompressors.Unzip)
+        assert archive.streaming
+        assert not archive.single()
+        assert archive.compressions == ["zip"]
+        assert archive.realname == "test_file"
+        iterator = archive.iter_members()
+        info, stream = next(iterator)
+        assert info.filename == "a/"
+        assert info.is_dir()
+        assert stream.read() == b""
+        for (info, stream), (filename, expected) in zip(iterator, files[1:]):
+            assert info.filename == filename
+            assert stream.read() == expected
+        assert [x.filename for x in archive.members()] == [
+            "a/",
+            "a/test_file1",
+            "b/test_file2",
+            "b/test_file3",
+        ]
+        with pytest.raises(io.UnsupportedOperation):
+            archive.open(archive.members()[1])
+
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        archive.extractall(str(tmp_path))
+    assert (tmp_path / "a").is_dir()
+    for filename, expected in files[1:]:
+        assert (tmp_path / filename).read_bytes() == expected
+
+    # NOTE: the archive itself can still be read
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert archive.read() == data
+
+
+@pytest.mark.parametrize("seekable", [True, False])
+def test_zip_streaming_single_file(seekable):
+    data = _zip_members(
+        [("test_file", b"Hello World\n" * 1000)],
+        zipfile.ZIP_DEFLATED,
+        seekable,
+    )
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert isinstance(archive, destream.decompressors.Unzip)
+        assert archive.single()
+        assert archive.compressions == ["zip:test_file"]
+        assert archive.read() == b"Hello World\n" * 1000
+        assert [x.filename for x in archive.members()] == ["test_file"]
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_zip_streaming_option(tmp_path, streaming):
+    files = [("a", b"Hello\n"), ("b", b"World\n")]
+    path = tmp_path / "test_file.zip"
+    path.write_bytes(_zip_members(files, zipfile.ZIP_DEFLATED, True))
+    with destream.open(path, streaming=streaming) as archive:
+        assert isinstance(archive, destream.decompressors.Unzip)
+        assert archive.streaming is streaming
+        assert [
+            (info.filename, stream.read())
+            for info, stream in archive.iter_members()
+        ] == files
+
+
+@pytest.mark.parametrize("position", [0, 1, 3])
+def test_zip_streaming_not_streamable(tmp_path, position):
+    files = [("test_file%d" % i, os.urandom(100) * 100) for i in range(5)]
+    raw = BytesIO()
+    with zipfile.ZipFile(raw, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for i, (filename, data) in enumerate(files):
+            compression = zipfile.ZIP_LZMA if i == position else None
+            zipf.writestr(filename, data, compress_type=compression)
+    fileobj = io.BufferedReader(NonSeekable(raw.getvalue(), "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        # NOTE: the first two members are read when the archive is opened
+        assert archive.streaming is (position > 1)
+        assert [
+            (info.filename, stream.read())
+            for info, stream in archive.iter_members()
+        ] == files
+        assert [x.filename for x in archive.members()] == [x for x, _ in files]
+    fileobj = io.BufferedReader(NonSeekable(raw.getvalue(), "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        archive.extractall(str(tmp_path))
+    for filename, data in files:
+        assert (tmp_path / filename).read_bytes() == data
+
+
+def test_zip_streaming_encrypted():
+    data = bytearray(
+        _zip_members(
+            [("a", b"Hello"), ("b", b"World")], zipfile.ZIP_STORED, True
+        )
+    )
+    # NOTE: mark the second member as encrypted in its local header and in
+    #       the central directory
+    for signature, offset in ((b"PK\x03\x04", 6), (b"PK\x01\x02", 8)):
+        pos = data.index(signature, data.index(signature) + 1)
+        data[pos + offset] |= 1
+    fileobj = io.BufferedReader(NonSeekable(bytes(data), "test_file.zip"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert not archive.streaming
+        assert [x.filename for x in archive.members()] == ["a", "b"]
+        with archive.open("a") as fh:
+            assert fh.read() == b"Hello"
+        with pytest.raises(RuntimeError):
+            archive.open("b")
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_zip_open_checks_local_header(tmp_path, on_disk):
+    data = bytearray(_zip_members([("a", b"a"), ("b", b"b")], 0, True))
+    # NOTE: rename the second member in its local header only
+    pos = data.index(b"PK\x03\x04", 1)
+    data[pos + 30] = ord("c")
+    # NOTE: mark the first member as compressed patched data in the central
+    #       directory
+    data[data.index(b"PK\x01\x02") + 8] |= 0x20
+    if on_disk:
+        (tmp_path / "test_file.zip").write_bytes(data)
+        archive = destream.open(tmp_path / "test_file.zip")
+    else:
+        archive = destream.open(fileobj=BytesIO(bytes(data)))
+    with archive:
+        with pytest.raises(NotImplementedError):
+            archive.open("a")
+        with pytest.raises(zipfile.BadZipFile):
+            archive.open("b")
+
+
+def test_zip_open_shares_central_directory():
+    data = _zip_members([("a", b"Hello"), ("b", b"World")], 0, True)
+    with destream.open(fileobj=BytesIO(data)) as archive:
+
+        def read(name):
+            with archive.open(name) as fh:
+                return fh.read(), archive._local.zipfile.filelist
+
+        with ThreadPoolExecutor(2) as executor:
+            results = list(executor.map(read, ["a", "b"]))
+        results.append(read("a"))
+        for (content, filelist), expected in zip(
+            results, [b"Hello", b"World", b"Hello"]
+        ):
+            assert content == expected
+            assert filelist is archive.zipfile.filelist
+
+
+def test_zip_streaming_truncated_compressed_size():
+    data = bytearray(
+        _zip_members(
+            [("a", os.urandom(1000)), ("b", b"b")], zipfile.ZIP_DEFLATED, True
+        )
+    )
+    (compress_size,) = struct.unpack_from("<I", data, 18)
+    struct.pack_into("<I", data, 18, compress_size - 20)
+    fileobj = io.BufferedReader(NonSeekable(bytes(data), "test_file.zip"))
+    with pytest.raises(zipfile.BadZipFile):
+        destream.open(fileobj=fileobj)
+
+
+def test_zip_streaming_bad_crc():
+    data = bytearray(_zip_members([("a", b"a"), ("b", b"b")], 0, True))
+    data[30 + 1] = ord("c")
+    fileobj = io.BufferedReader(NonSeekable(bytes(data), "test_file.zip"))
+    with pytest.raises(zipfile.BadZipFile):
+        destream.open(fileobj=fileobj)
+
+
+def _tar_members(files):
+    raw = BytesIO()
+    with tarfile.open(fileobj=raw, mode="w") as tar:
+        for filename, data in files:
+            tarinfo = tarfile.TarInfo(filename)
+            if data is None:
+                tarinfo.type = tarfile.DIRTYPE
+                tar.addfile(tarinfo)
+            else:
+                tarinfo.size = len(data)
+                tar.addfile(tarinfo, BytesIO(data))
+    return raw.getvalue()
+
+
+def test_tar_streaming_multiple_files(tmp_path):
+    files = [
+        ("a", None),
+        ("a/test_file1", os.urandom(100) * 1000),
+        ("b/test_file2", b""),
+        ("b/test_file3", b"Hello World\n"),
+    ]
+    data = _tar_members(files)
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.tar"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert isinstance(archive, destream.decompressors.Untar)
+        assert archive.streaming
+        assert not archive.single()
+        assert archive.compressions == ["tar"]
+        assert archive.realname == "test_file"
+        iterator = archive.iter_members()
+        for (member, stream), (filename, expected) in zip(iterator, files):
+            assert member.name == filename
+            assert stream.read() == (expected or b"")
+        assert [x.name for x in archive.members()] == [x for x, _ in files]
+        with pytest.raises(io.UnsupportedOperation):
+            archive.open(archive.members()[1])
+
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.tar"))
+    with destream.open(fileobj=fileobj) as archive:
+        archive.extractall(str(tmp_path))
+    assert (tmp_path / "a").is_dir()
+    for filename, expected in files[1:]:
+        assert (tmp_path / filename).read_bytes() == expected
+
+    # NOTE: the archive itself can still be read
+    fileobj = io.BufferedReader(NonSeekable(data, "test_file.tar"))
+    with destream.open(fileobj=fileobj) as archive:
+        assert archive.read() == data
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_tar_streaming_option(tmp_path, streaming):
+    files = [("a", b"Hello\n"), ("b", b"World\n")]
+    path = tmp_path / "test_file.tar"
+    path.write_bytes(_tar_members(files))
+    with destream.open(path, streaming=streaming) as archive:
+        assert isinstance(archive, destream.decompressors.Untar)
+        assert archive.streaming is streaming
+        assert [
+            (info.name, stream.read())
+            for info, stream in archive.iter_members()
+        ] == files
+    fileobj = io.BufferedReader(NonSeekable(_tar_members(files), "x.tar"))
+    with destream.open(fileobj=fileobj, streaming=False) as archive:
+        assert not archive.streaming
+        assert [x.name for x in archive.members()] == ["a", "b"]
+
+
+def test_tar_streaming_single_file():
+    data = _tar_members([("test_file", b"Hello World\n" * 1000)])
+    raw = BytesIO(gzip.compress(data))
+    raw.name = "test_file.tar.gz"
+    with destream.open(fileobj=raw) as archive:
+        assert isinstance(archive, destream.decompressors.Untar)
+        assert archive.streaming
+        assert archive.single()
+        assert archive.compressions == ["gzip", "tar:test_file"]
+        assert archive.read() == b"Hello World\n" * 1000
+        assert [x.name for x in archive.members()] == ["test_file"]
+        [(member, stream)] = archive.iter_members()
+        assert stream.read() == b"Hello World\n" * 1000
+
+
+@pytest.mark.parametrize(
+    "compress",
+    [
+        lambda x: gzip.compress(bz2.compress(x)),
+        lambda x: gzip.compress(lzma.compress(gzip.compress(x))),
+    ],
+)
+def test_external_pipe_chained(tmp_path, compress):
+    data = os.urandom(300000)
+    path = tmp_path / "test_file"
+    path.write_bytes(compress(data))
+    with destream.open(path, engine="external") as archive:
+        assert archive.read() == data
+        stage = archive
+        while isinstance(stage.source, destream.ExternalPipe):
+            # NOTE: the commands are connected with OS pipes
+            assert stage.t is None
+            assert stage._upstream is stage.source
+            stage = stage.source
+        assert len(archive.compressions) in (2, 3)
+    assert stage.closed
+    assert stage.p.poll() is not None
+
+
+@pytest.mark.parametrize("compress", [gzip.compress, bgzf_compress])
+def test_gzip_seekable(tmp_path, compress):
+    data = bytes(x % 13 for x in os.urandom(1000000)) + os.urandom(300000)
+    path = tmp_path / "test_file.gz"
+    path.write_bytes(compress(data[:500000]) + compress(data[500000:]))
+    for _ in range(2):
+        with destream.open(
+            path, seekable=True, checkpoint_interval=100000, index=True
+        ) as archive:
+            assert archive.seekable()
+            assert archive.seek(0, io.SEEK_END) == len(data)
+            for pos, size in [
+                (1200000, 1000),
+                (10, 300000),
+                (len(data) - 10, 100),
+                (499990, 20),
+                (0, len(data)),
+                (len(data) + 10, 10),
+            ]:
+                assert archive.seek(pos) == pos
+                assert archive.read(size) == data[pos : pos + size]
+        # NOTE: the second time, the checkpoints at the start of the members
+        #       are loaded from the index
+        assert (tmp_path / "test_file.gz.gzidx").exists()
+
+
+def test_gzip_seekable_external():
+    raw = BytesIO(gzip.compress(b"Hello World\n"))
+    raw.name = "test_file.gz"
+    with pytest.raises(OSError):
+        destream.open(fileobj=raw, seekable=True, engine="external")
+
+
+def _run(coroutine):
+    # NOTE: asyncio.run() is not available on Python 3.6
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+@pytest.mark.parametrize("engine", ["internal", "external"])
+def test_aopen(tmp_path, engine):
+    data = os.urandom(100000) * 3
+    compressed = lzma.compress(gzip.compress(data))
+    path = tmp_path / "test_file.gz.xz"
+    path.write_bytes(compressed)
+
+    async def check(**kwargs):
+        async with await destream.aopen(engine=engine, **kwargs) as archive:
+            assert os.path.basename(archive.realname) == "test_file"
+            assert archive.compressions == ["xz", "gzip"]
+            assert archive.pack is None
+            assert await archive.readexactly(10) == data[:10]
+            chunks = [await archive.read(5)]
+            async for chunk in archive:
+                chunks.append(chunk)
+            assert b"".join(chunks) == data[10:]
+            with pytest.raises(asyncio.IncompleteReadError):
+                await archive.readexactly(1)
+        assert archive.closed
+
+    async def check_stream_reader():
+        reader = asyncio.StreamReader()
+        reader.feed_data(compressed)
+        reader.feed_eof()
+        await check(fileobj=reader, name="test_file.gz.xz")
+
+    _run(check(name=str(path)))
+    _run(check(fileobj=BytesIO(compressed), name="test_file.gz.xz"))
+    _run(check_stream_reader())
+
+
+def test_aopen_does_not_block_the_loop(tmp_path):
+    data = os.urandom(1000) * 10000
+    path = tmp_path / "test_file.gz"
+    path.write_bytes(gzip.compress(data))
+    ticks = []
+
+    async def tick():
+        while True:
+            ticks.append(None)
+            await asyncio.sleep(0)
+
+    async def check():
+        ticker = asyncio.ensure_future(tick())
+        await asyncio.sleep(0)
+        async with await destream.aopen(str(path), engine="internal") as fh:
+            start = len(ticks)
+            assert await fh.read() == data
+        ticker.cancel()
+        # NOTE: the loop ran while the file was read and decompressed
+        assert len(ticks) - start > 10
+
+    _run(check())
+
+
+def test_aopen_hooks(tmp_path):
+    data = os.urandom(100000)
+    path = tmp_path / "test_file.gz"
+    path.write_bytes(gzip.compress(data))
+    events = []
+    guesser = destream.AsyncGuesser(engine="external")
+    guesser.add_hook(events.append)
+
+    async def check():
+        async with await guesser.open(str(path)) as archive:
+            assert await archive.read() == data
+        return archive
+
+    archive = _run(check())
+    names = [x["event"] for x in events]
+    assert names[:5] == [
+        "layer_opened",
+        "mime",
+        "decompressor_tried",
+        "subprocess_spawned",
+        "layer_opened",
+    ]
+    assert names[-1] == "subprocess_exited"
+    assert events[-1]["archive"] is archive
+    assert events[-1]["returncode"] == 0
+
+
+def test_aopen_pack():
+    raw = BytesIO(gzip.compress(_tar_bytes(tarfile.GNU_FORMAT)))
+    raw.name = "test_file.tar.gz"
+
+    async def check():
+        async with await destream.aopen(fileobj=raw) as archive:
+            assert archive.pack is destream.decompressors.Untar
+            assert await archive.read() == _tar_bytes(tarfile.GNU_FORMAT)
+
+    _run(check())
+
+
+def _snapshot(path):
+    snapshot = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            full = os.path.join(root, name)
+            st = os.lstat(full)
+            data = None
+            if os.path.islink(full):
+                data = os.readlink(full)
+            elif os.path.isfile(full):
+                data = Path(full).read_bytes()
+            snapshot[os.path.relpath(full, path)] = (st.st_mode, data)
+    return snapshot
+
+
+def _tar_tree(links=True):
+    members = [
+        ("a", tarfile.DIRTYPE, None),
+        ("a/b", tarfile.DIRTYPE, None),
+        ("a/b/file1", tarfile.REGTYPE, os.urandom(100000)),
+        ("a/file2", tarfile.REGTYPE, b"Hello World\n"),
+        ("c/file3", tarfile.REGTYPE, b""),
+    ]
+    if links:
+        members += [
+            ("a/link", tarfile.SYMTYPE, "file2"),
+            ("a/hardlink", tarfile.LNKTYPE, "a/file2"),
+        ]
+    return _tar_entries(
+        members + [(f"d/{i}", tarfile.REGTYPE, b"%d" % i) for i in range(50)]
+    )
+
+
+def _tar_entries(members):
+    raw = BytesIO()
+    with tarfile.open(fileobj=raw, mode="w") as tar:
+        for name, kind, data in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.type = kind
+            tarinfo.mode = 0o750 if kind == tarfile.DIRTYPE else 0o640
+            tarinfo.mtime = 1000000000
+            if kind in (tarfile.SYMTYPE, tarfile.LNKTYPE):
+                tarinfo.linkname = data
+                data = None
+            if data is not None:
+                tarinfo.size = len(data)
+            tar.addfile(tarinfo, BytesIO(data) if data is not None else None)
+    return raw.getvalue()
+
+
+@pytest.mark.parametrize("links", [False, True])
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_tar_extractall_workers(tmp_path, on_disk, links):
+    data = _tar_tree(links)
+    if on_disk:
+        (tmp_path / "test_file.tar").write_bytes(data)
+        open_ = lambda: destream.open(tmp_path / "test_file.tar")
+    else:
+        open_ = lambda: destream.open(fileobj=BytesIO(data))
+    with open_() as archive:
+        archive.extractall(str(tmp_path / "sequential"))
+    with open_() as archive:
+        assert isinstance(archive, destream.decompressors.Untar)
+        archive.extractall(str(tmp_path / "parallel"), workers=4)
+    expected = _snapshot(tmp_path / "sequential")
+    assert len(expected) == (59 if links else 57)
+    assert _snapshot(tmp_path / "parallel") == expected
+    for name in ["a", "a/b", "a/file2"]:
+        assert (tmp_path / "parallel" / name).stat().st_mtime == 1000000000
+
+
+def test_tar_extractall_workers_symlink_outside(tmp_path):
+    outside = tmp_path / "outside"
+    outside.write_bytes(b"secret")
+    outside.chmod(0o600)
+    data = _tar_entries(
+        [
+            ("file", tarfile.REGTYPE, b"Hello World\n"),
+            ("file", tarfile.SYMTYPE, str(outside)),
+        ]
+        + [(f"d/{i}", tarfile.REGTYPE, b"%d" % i) for i in range(10)]
+    )
+    with destream.open(fileobj=BytesIO(data)) as archive:
+        archive.extractall(str(tmp_path / "parallel"), workers=4)
+    assert os.readlink(tmp_path / "parallel" / "file") == str(outside)
+    assert outside.stat().st_mode & 0o777 == 0o600
+    assert (tmp_path / "parallel" / "d" / "9").read_bytes() == b"9"
+
+
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_zip_extractall_workers(tmp_path, on_disk):
+    files = [("a", None), ("a/b/file1", os.urandom(100000))] + [
+        (f"d/{i}", b"%d" % i * 1000) for i in range(50)
+    ]
+    data = _zip_members(files, zipfile.ZIP_DEFLATED, True)
+    if on_disk:
+        (tmp_path / "test_file.zip").write_bytes(data)
+        open_ = lambda: destream.open(tmp_path / "test_file.zip")
+    else:
+        open_ = lambda: destream.open(fileobj=BytesIO(data))
+    with open_() as archive:
+        assert isinstance(archive, destream.decompressors.Unzip)
+        archive.extractall(str(tmp_path / "parallel"), workers=4)
+    for filename, content in files:
+        path = tmp_path / "parallel" / filename
+        if content is None:
+            assert path.is_dir()
+        else:
+            assert path.read_bytes() == content
+
+
+@pytest.mark.filterwarnings("ignore:Duplicate name")
+def test_zip_extractall_workers_repeated_name(tmp_path):
+    data = _zip_members(
+        [("x", os.urandom(8 << 20)), ("x", b"Hello")]
+        + [(f"d/{i}", b"%d" % i) for i in range(10)],
+        zipfile.ZIP_DEFLATED,
+        True,
+    )
+    with destream.open(fileobj=BytesIO(data)) as archive:
+        archive.extractall(str(tmp_path), workers=4)
+    assert (tmp_path / "x").read_bytes() == b"Hello"
+    assert (tmp_path / "d" / "9").read_bytes() == b"9"
+
+
+@pytest.mark.parametrize("format", ["tar", "zip"])
+@pytest.mark.parametrize("on_disk", [False, True])
+def test_members_read_concurrently(tmp_path, format, on_disk):
+    files = [(f"file{i}", os.urandom(50000 + i)) for i in range(16)]
+    if format == "tar":
+        raw = BytesIO()
+        with tarfile.open(fileobj=raw, mode="w") as tar:
+            for filename, content in files:
+                tarinfo = tarfile.TarInfo(filename)
+                tarinfo.size = len(content)
+                tar.addfile(tarinfo, BytesIO(content))
+        data = raw.getvalue()
+    else:
+        data = _zip_members(files, zipfile.ZIP_DEFLATED, True)
+    if on_disk:
+        (tmp_path / f"test_file.{format}").write_bytes(data)
+        archive = destream.open(tmp_path / f"test_file.{format}")
+    else:
+        archive = destream.open(fileobj=BytesIO(data))
+    expected = dict(files)
+
+    def read(member):
+        name = getattr(member, "name", None) or member.filename
+        with archive.open(member) as fh:
+            chunks = []
+            while True:
+                chunk = fh.read(1000)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        return b"".join(chunks) == expected[name]
+
+    with archive:
+        position = archive.source.tell()
+        with ThreadPoolExecutor(8) as executor:
+            assert all(executor.map(read, archive.members() * 4))
+        assert archive.source.tell() == position
+
+
+@pytest.mark.parametrize("engine", ["internal", "external"])
+def test_open_mmap(tmp_path, engine):
+    content = os.urandom(100000)
+    paths = {
+        "test_file.gz": gzip.compress(content),
+        "test_file.zip": _zip_members(
+            [("a", content), ("b", content)], zipfile.ZIP_STORED, True
+        ),
+        "test_file.tar": _tar_tree(),
+    }
+    for filename, data in paths.items():
+        (tmp_path / filename).write_bytes(data)
+    with destream.open(
+        tmp_path / "test_file.gz", mmap=True, engine=engine
+    ) as archive:
+        assert isinstance(archive.source, destream.ArchiveMmap)
+        if engine == "external":
+            # NOTE: the command reads the file itself
+            assert archive.t is None
+        assert archive.read() == content
+    with destream.open(tmp_path / "test_file.zip", mmap=True) as archive:
+        assert isinstance(archive.source, destream.ArchiveMmap)
+        for info in archive.members():
+            with archive.open(info) as fh:
+                assert fh.read() == content
+    with destream.open(tmp_path / "test_file.tar", mmap=True) as archive:
+        archive.extractall(str(tmp_path / "mmap"), workers=2)
+    with destream.open(tmp_path / "test_file.tar") as archive:
+        archive.extractall(str(tmp_path / "file"))
+    assert _snapshot(tmp_path / "mmap") == _snapshot(tmp_path / "file")
+    # NOTE: not a regular file
+    raw = BytesIO(gzip.compress(content))
+    with destream.open(fileobj=raw, mmap=True) as archive:
+        assert archive.read() == content
+
+
+@pytest.mark.parametrize("engine", ["internal", "external"])
+def test_open_stats(tmp_path, engine):
+    data = os.urandom(300000)
+    path = tmp_path / "test_file.gz.xz"
+    path.write_bytes(lzma.compress(gzip.compress(data)))
+    with destream.open(path, stats=True, engine=engine) as archive:
+        assert archive.read() == data
+        stats = archive.stats()
+        assert [x["layer"] for x in stats] == [
+            "ArchiveFile",
+            "Unxz",
+            "Gunzip",
+        ]
+        if engine == "internal":
+            assert stats[0]["bytes_out"] == path.stat().st_size
+        # NOTE: the command reads the file itself with the external engine
+        assert stats[1]["bytes_in"] == path.stat().st_size
+        assert stats[-1]["bytes_out"] == len(data)
+        assert stats[-1]["bytes_in"] == stats[-2]["bytes_out"]
+        for layer in stats[1:]:
+            assert layer["guess"] >= 0
+            assert layer["check_availability"] >= 0
+            assert layer["init"] >= 0
+        assert stats[-1]["read_calls"] > 0
+        if engine == "external":
+            # NOTE: the output of unxz goes straight to gunzip
+            assert stats[1]["bytes_out"] is None
+    # NOTE: the CPU time is known once the commands are waited
+    for layer in archive.stats()[1:]:
+        if engine == "external":
+            assert layer["cpu_seconds"] > 0
+        else:
+            assert "cpu_seconds" not in layer
+    if engine == "external":
+        # NOTE: the command has exited (but is not waited) before close()
+        with destream.open(path, stats=True, engine=engine) as archive:
+            assert archive.read() == data
+            os.waitid(os.P_PID, archive.p.pid, os.WEXITED | os.WNOWAIT)
+        assert archive.stats()[-1]["cpu_seconds"] > 0
+    with destream.open(path, engine=engine) as archive:
+        assert archive.stats()[-1]["read_calls"] is None